@@ -1,10 +1,25 @@
+import calendar
+import functools
+import glob
 import gzip
-import io
-import math
+import hashlib
+import itertools
+import mimetypes
 import os
-from bottle import Bottle, run, template, static_file, request, response, abort, HTTPError
-
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlencode
+from bottle import (Bottle, BaseTemplate, run, template, static_file, request, response,
+                    abort, HTTPError, HTTPResponse, http_date, parse_date)
+
+import assets
 import db
+import sitemaps
 import utils
 
 app = Bottle()
@@ -15,86 +30,527 @@ app = Bottle()
 _COMPRESSIBLE = ('text/', 'application/json', 'application/javascript',
                  'application/xml', 'image/svg')
 
-class GzipMiddleware:
-    """Comprime le risposte HTTP con gzip se il client le accetta."""
+def _weak_etag(headers):
+    """Un ETag forte vale per i byte non compressi: sulla variante gzip diventa debole."""
+    return [(k, 'W/' + v if k.lower() == 'etag' and v.startswith('"') else v)
+            for k, v in headers]
+
 
-    def __init__(self, wsgi_app, min_size=512):
-        self.app      = wsgi_app
-        self.min_size = min_size
+GZIP_CACHE_MB = int(os.environ.get('GZIP_CACHE_MB', 32))
+
+
+class GzipMiddleware:
+    """Comprime le risposte HTTP con gzip se il client le accetta.
+    I corpi già in memoria (liste) sono compressi in un colpo solo con
+    Content-Length; gli iterabili (generatori) sono compressi a blocchi con
+    zlib.compressobj e inviati man mano, senza bufferizzare l'intero corpo.
+    Le risposte 200 compresse sono conservate in una cache LRU con limite in
+    byte, per path+query ed ETag (o hash del corpo se manca l'ETag): le
+    richieste successive per la stessa versione non ricomprimono nulla."""
+
+    def __init__(self, wsgi_app, min_size=512, level=6, max_bytes=GZIP_CACHE_MB * 2**20):
+        self.app       = wsgi_app
+        self.min_size  = min_size
+        self.level     = level
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self.bytes_saved = 0               # byte non compressi serviti dalla cache
+        self._entries  = OrderedDict()     # chiave → (gz_body, byte non compressi)
+        self._bytes    = 0
+        self._lock     = threading.Lock()
+
+    def _compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += entry[1]
+            return entry
+
+    def _put(self, key, entry):
+        size = len(entry[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, ev = self._entries.popitem(last=False)
+                self._bytes -= len(ev[0])
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_ratio': self.hits / total if total else 0.0,
+                    'bytes_saved': self.bytes_saved,
+                    'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes}
+
+    def _should_compress(self, status, headers):
+        """True se una risposta con questi header va compressa."""
+        ctype, length = '', None
+        for k, v in headers:
+            lk = k.lower()
+            if lk == 'content-type':
+                ctype = v
+            elif lk == 'content-length':
+                length = int(v)
+            elif lk == 'content-encoding':
+                return False
+        return (status[:3] not in ('204', '206')
+                and (length is None or length >= self.min_size)
+                and any(t in ctype for t in _COMPRESSIBLE))
+
+    def _not_modified_headers(self, environ, headers):
+        # Un 304 riporta i validatori della 200: ETag debole solo se quella
+        # sarebbe stata compressa. Con Content-Type (static_file) vale la regola
+        # della 200; i 304 di conditional() non lo hanno, e la forma dell'ETag è
+        # quella che il client ha ricevuto con la 200 e rimanda in If-None-Match.
+        etag = next((v for k, v in headers if k.lower() == 'etag'), None)
+        if etag is None or not etag.startswith('"'):
+            return headers
+        if any(k.lower() == 'content-type' for k, _ in headers):
+            weak = self._should_compress('200 OK', headers)
+        else:
+            inm = environ.get('HTTP_IF_NONE_MATCH', '')
+            weak = 'W/' + etag in (t.strip() for t in inm.split(','))
+        return _weak_etag(headers) if weak else headers
 
     def __call__(self, environ, start_response):
         if 'gzip' not in environ.get('HTTP_ACCEPT_ENCODING', ''):
             return self.app(environ, start_response)
 
-        captured_status  = []
-        captured_headers = []
+        captured = []
 
         def fake_start(status, headers, exc_info=None):
-            captured_status.append(status)
-            captured_headers.append(list(headers))
+            captured[:] = [status, list(headers)]
 
-        body = b''.join(self.app(environ, fake_start))
+        result = self.app(environ, fake_start)
+        chunks = iter(result)
+        if not captured:
+            # Applicazione che chiama start_response solo alla prima iterazione
+            first = next(chunks, b'')
+            chunks = itertools.chain([first], chunks)
+        status, headers = captured
 
-        status  = captured_status[0]
-        headers = captured_headers[0]
+        if status.startswith('304'):
+            start_response(status, self._not_modified_headers(environ, headers))
+            return result
 
-        ctype = next((v for k, v in headers if k.lower() == 'content-type'), '')
-        should_compress = (
-            len(body) >= self.min_size
-            and any(t in ctype for t in _COMPRESSIBLE)
-        )
-
-        if not should_compress:
+        if not self._should_compress(status, headers):
             start_response(status, headers)
-            return [body]
-
-        buf = io.BytesIO()
-        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as f:
-            f.write(body)
-        compressed = buf.getvalue()
+            return result
 
-        new_headers = [(k, v) for k, v in headers
+        etag = next((v for k, v in headers if k.lower() == 'etag'), None)
+        new_headers = [(k, v) for k, v in _weak_etag(headers)
                        if k.lower() not in ('content-length', 'content-encoding')]
         new_headers += [
             ('Content-Encoding', 'gzip'),
-            ('Content-Length',   str(len(compressed))),
             ('Vary',             'Accept-Encoding'),
         ]
+
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            # Stessi header della GET, senza corpo: la lunghezza compressa non
+            # è nota senza comprimere, quindi niente Content-Length
+            if hasattr(result, 'close'):
+                result.close()
+            start_response(status, new_headers)
+            return []
+
+        in_memory = isinstance(result, (list, tuple))
+        key = None
+        if self.max_bytes > 0 and status.startswith('200'):
+            url = environ.get('PATH_INFO', '') + '?' + environ.get('QUERY_STRING', '')
+            if etag is not None:
+                key = (url, etag)
+            elif in_memory:
+                result = [b''.join(result)]
+                key = (url, hashlib.sha1(result[0]).digest())
+        entry = self._get(key) if key is not None else None
+        if entry is not None:
+            # Il corpo non viene consumato: un generatore non rende il resto
+            if hasattr(result, 'close'):
+                result.close()
+            start_response(status, new_headers + [('Content-Length', str(len(entry[0])))])
+            return [entry[0]]
+
+        if in_memory:
+            co = self._compressor()
+            compressed = b''.join(co.compress(c) for c in result) + co.flush()
+            if key is not None:
+                self._put(key, (compressed, sum(len(c) for c in result)))
+            start_response(status, new_headers + [('Content-Length', str(len(compressed)))])
+            return [compressed]
+
         start_response(status, new_headers)
-        return [compressed]
+        return self._stream(chunks, result, key)
+
+    def _stream(self, chunks, result, key=None):
+        co = self._compressor()
+        kept, kept_size, raw_size = [], 0, 0
+        try:
+            for i, chunk in enumerate(chunks):
+                raw_size += len(chunk)
+                data = co.compress(chunk)
+                if i == 0:
+                    # Il primo blocco (head della pagina) parte subito
+                    data += co.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    if key is not None and kept_size + len(data) <= self.max_bytes:
+                        kept.append(data)
+                        kept_size += len(data)
+                    else:
+                        key = None
+                    yield data
+            data = co.flush()
+            if key is not None and kept_size + len(data) <= self.max_bytes:
+                # Corpo inviato per intero: si conserva per le richieste successive
+                kept.append(data)
+                self._put(key, (b''.join(kept), raw_size))
+            yield data
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+# ── Cache delle pagine renderizzate ────────────────────────────────
+
+# Pagina città e sottopagine: deterministiche per URL e giorno UTC
+_CITY_PAGE_RE = re.compile(
+    r'^/country/[^/]+/[^/]+/[^/]+/(?:(?:time|sunrise|moon|golden-hour|daylight|nearby)/)?$')
+
+PAGE_CACHE_MB   = int(os.environ.get('PAGE_CACHE_MB', 128))
+PAGE_CACHE_GZIP = os.environ.get('PAGE_CACHE_GZIP', 'true').lower() == 'true'
+
+
+class PageCacheMiddleware:
+    """Cache in memoria delle risposte 200 alle GET (e HEAD) sui path che
+    corrispondono a path_re, per path+query. Le voci valgono fino alla
+    mezzanotte UTC (come utils._day_cache) o fino a una modifica del DB; LRU
+    con limite in byte. Con compress=True conserva anche il corpo gzip, servito
+    a chi lo accetta."""
+
+    def __init__(self, wsgi_app, max_bytes=PAGE_CACHE_MB * 2**20,
+                 compress=PAGE_CACHE_GZIP, path_re=_CITY_PAGE_RE):
+        self.app       = wsgi_app
+        self.max_bytes = max_bytes
+        self.compress  = compress
+        self.path_re   = path_re
+        self.hits = self.misses = self.evictions = 0
+        self._entries  = OrderedDict()   # chiave → (status, headers, body, gz_body, creazione)
+        self._bytes    = 0
+        self._valid_for = None            # (giorno UTC, generazione DB) delle voci
+        self._lock     = threading.Lock()
+
+    def _get(self, key):
+        """(voce o None, validità verificata): la validità va ripassata a _put."""
+        valid_for = (datetime.utcnow().date(), db.data_generation())
+        with self._lock:
+            if valid_for != self._valid_for:
+                # Nuovo giorno o nuovi dati: tutte le voci scadono insieme
+                self._entries.clear()
+                self._bytes = 0
+                self._valid_for = valid_for
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, valid_for
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry, valid_for
+
+    def _put(self, key, entry, valid_for):
+        size = len(entry[2]) + len(entry[3] or b'')
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if valid_for != self._valid_for:
+                return      # resa prima di mezzanotte o di un nuovo DB, finita dopo
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[2]) + len(old[3] or b'')
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, ev = self._entries.popitem(last=False)
+                self._bytes -= len(ev[2]) + len(ev[3] or b'')
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_ratio': self.hits / total if total else 0.0,
+                    'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes}
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        method = environ.get('REQUEST_METHOD')
+        if (self.max_bytes <= 0 or method not in ('GET', 'HEAD')
+                or not self.path_re.match(path)):
+            return self.app(environ, start_response)
+        head = method == 'HEAD'
+
+        key = path + '?' + environ.get('QUERY_STRING', '')
+        entry, valid_for = self._get(key)
+        if entry is None:
+            captured = []
+
+            def capture(status, headers, exc_info=None):
+                captured[:] = [status, list(headers)]
+
+            # HEAD: resa come GET (come fa bottle), così ha gli stessi header e
+            # la voce serve anche le GET successive
+            body = b''.join(self.app(dict(environ, REQUEST_METHOD='GET') if head else environ,
+                                     capture))
+            status, headers = captured
+            if not status.startswith('200'):
+                start_response(status, headers)
+                return [b''] if head else [body]
+            # Server-Timing descrive solo la richiesta che ha generato la voce
+            headers = [(k, v) for k, v in headers
+                       if k.lower() not in ('content-length', 'server-timing')]
+            gz_body = gzip.compress(body, compresslevel=6) if self.compress else None
+            entry = (status, headers, body, gz_body, time.time())
+            self._put(key, entry, valid_for)
+
+        status, headers, body, gz_body, created = entry
+        # Age: il Cache-Control conservato è quello del momento del rendering
+        headers = headers + [('Age', str(int(time.time() - created)))]
+        use_gzip = gz_body is not None and 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '')
+        if use_gzip:
+            headers = _weak_etag(headers)
+        if gz_body is not None:
+            headers = headers + [('Vary', 'Accept-Encoding')]
+
+        validators = {k.lower(): v for k, v in headers if k.lower() in ('etag', 'last-modified')}
+        if 'etag' in validators and _not_modified(
+                environ, validators['etag'], parse_date(validators.get('last-modified', '')) or 0):
+            start_response('304 Not Modified',
+                           [(k, v) for k, v in headers if k.lower() != 'content-type'])
+            return [b'']
+
+        if use_gzip:
+            body = gz_body
+            headers.append(('Content-Encoding', 'gzip'))
+        start_response(status, headers + [('Content-Length', str(len(body)))])
+        return [b''] if head else [body]
+
 
 BASE_URL = os.environ.get('BASE_URL', 'https://example.com').rstrip('/')
 
 
+# ── Validatori HTTP (ETag / Last-Modified) ────────────────────────
+# ETag calcolato prima di eseguire la vista, da: versione del codice e dei
+# template, versione del file DB, URL e (per le pagine che cambiano ogni
+# giorno) data UTC. Uguale in tutti i worker, quindi un 304 non richiede
+# né query né rendering.
+
+def _code_version():
+    h = hashlib.sha1()
+    here = os.path.dirname(os.path.abspath(__file__))
+    views = os.path.join(here, 'views')
+    # Tutti i moduli della directory, non solo quelli importati: l'elenco (e
+    # quindi l'ETag) è lo stesso per server, export.py, asgi.py e warmup.py
+    files = sorted(glob.glob(os.path.join(here, '*.py')))
+    files += [os.path.join(views, f) for f in sorted(os.listdir(views))]
+    # Gli URL degli asset con hash finiscono nelle pagine
+    if os.path.isfile(assets.manifest_path()):
+        files.append(assets.manifest_path())
+    for path in files:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:12]
+
+
+_CODE_VERSION = _code_version()
+
+
+def _validators(daily):
+    """(etag, last_modified) della richiesta corrente."""
+    last_modified = db.data_mtime()
+    day = ''
+    if daily:
+        today = datetime.utcnow().date()
+        day = today.isoformat()
+        last_modified = max(last_modified, calendar.timegm(today.timetuple()))
+    raw = '|'.join((_CODE_VERSION, db.data_version(), day, BASE_URL,
+                    request.path, request.query_string))
+    return '"%s"' % hashlib.sha1(raw.encode()).hexdigest()[:20], int(last_modified)
+
+
+def _etag_matches(header, etag):
+    # Confronto debole (RFC 9110 §13.1.2): W/"x" equivale a "x". '*' è ignorato:
+    # la vista non sa ancora se la risorsa esiste, quindi si risponde per intero
+    bare = etag[2:] if etag.startswith('W/') else etag
+    return any((t[2:] if t.startswith('W/') else t) == bare
+               for t in (t.strip() for t in header.split(',')))
+
+
+def _not_modified(environ, etag, last_modified):
+    """True se i validatori inviati dal client corrispondono a quelli correnti."""
+    inm = environ.get('HTTP_IF_NONE_MATCH')
+    if inm is not None:
+        return _etag_matches(inm, etag)
+    ims = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if ims:
+        ts = parse_date(ims.split(';')[0].strip())
+        return ts is not None and ts >= last_modified
+    return False
+
+
+# ── Cache-Control ─────────────────────────────────────────────────
+# Pagine giornaliere (città e sottopagine): fresche fino alla mezzanotte UTC,
+# quando cambiano i dati astronomici. Le altre cambiano solo con un nuovo
+# import: TTL lungo e stale-while-revalidate, poi rivalidazione via ETag.
+
+CACHE_MAX_AGE          = int(os.environ.get('CACHE_MAX_AGE', 3600))      # browser
+CACHE_S_MAXAGE         = int(os.environ.get('CACHE_S_MAXAGE', 86400))    # CDN / proxy
+CACHE_STALE_REVALIDATE = int(os.environ.get('CACHE_STALE_REVALIDATE', 86400))
+CACHE_DAILY_STALE      = int(os.environ.get('CACHE_DAILY_STALE', 0))     # dopo la mezzanotte
+
+
+def cache_control(daily):
+    """Valore di Cache-Control per una pagina giornaliera o legata all'import."""
+    if daily:
+        ttl = 86400 - int(time.time()) % 86400   # secondi alla mezzanotte UTC
+        value = f'public, max-age={ttl}, s-maxage={ttl}'
+        if CACHE_DAILY_STALE:
+            value += f', stale-while-revalidate={CACHE_DAILY_STALE}'
+        return value
+    return (f'public, max-age={CACHE_MAX_AGE}, s-maxage={CACHE_S_MAXAGE}, '
+            f'stale-while-revalidate={CACHE_STALE_REVALIDATE}')
+
+
+def conditional(daily=False):
+    """Decoratore per le viste: imposta ETag, Last-Modified e Cache-Control e
+    risponde 304 senza eseguire la vista se il client ha già la versione corrente.
+    daily=True per le pagine il cui contenuto cambia alla mezzanotte UTC."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag, last_modified = _validators(daily)
+            if _not_modified(request.environ, etag, last_modified):
+                return HTTPResponse(status=304, headers={
+                    'ETag': etag, 'Last-Modified': http_date(last_modified),
+                    'Cache-Control': cache_control(daily)})
+            response.set_header('ETag', etag)
+            response.set_header('Last-Modified', http_date(last_modified))
+            response.set_header('Cache-Control', cache_control(daily))
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
 # ── Asset statici ─────────────────────────────────────────────────
 
+# File con hash nel nome (assets.py build): contenuto immutabile, cache di un
+# anno. Se esiste la variante .gz precompressa la si serve a chi accetta gzip.
+
+STATIC_ROOT = assets.STATIC_ROOT
+
+BaseTemplate.defaults['asset_url'] = assets.asset_url
+
+
 @app.route('/static/<filepath:path>')
 def static(filepath):
-    return static_file(filepath, root='./static')
+    headers = {}
+    if assets.is_fingerprinted(filepath):
+        headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    if os.path.isfile(os.path.join(STATIC_ROOT, filepath + '.gz')):
+        headers['Vary'] = 'Accept-Encoding'
+        if 'gzip' in request.environ.get('HTTP_ACCEPT_ENCODING', ''):
+            headers['Content-Encoding'] = 'gzip'
+            mimetype = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+            return static_file(filepath + '.gz', root=STATIC_ROOT,
+                               mimetype=mimetype, headers=headers)
+    return static_file(filepath, root=STATIC_ROOT, headers=headers)
 
 
 # ── robots.txt ────────────────────────────────────────────────────
 
 @app.route('/robots.txt')
+@conditional()
 def robots():
     response.content_type = 'text/plain'
     return f"User-agent: *\nAllow: /\nSitemap: {BASE_URL}/sitemap.xml\n"
 
 
-# ── Sitemap index ─────────────────────────────────────────────────
+# ── Sitemap ───────────────────────────────────────────────────────
+# Servite dai file precostruiti in sitemaps.SITEMAP_DIR (vedi sitemaps.py) con
+# static_file (Range, If-Modified-Since); se mancano, o sono stati costruiti
+# per un BASE_URL diverso, rese dal DB.
+
+_prebuilt_checked = {}   # mtime del manifest → True se costruito per BASE_URL
+
+
+def _prebuilt_usable(root):
+    try:
+        mtime = os.stat(os.path.join(root, sitemaps.MANIFEST)).st_mtime_ns
+    except OSError:
+        return False
+    usable = _prebuilt_checked.get(mtime)
+    if usable is None:
+        built_for = sitemaps.built_base_url(root)
+        usable = built_for == BASE_URL
+        if not usable:
+            print(f'ATTENZIONE: sitemap in {root} costruite per BASE_URL={built_for}, '
+                  f'l\'app usa {BASE_URL}: rese dal DB finché non si ricostruiscono '
+                  f'(BASE_URL={BASE_URL} python csv_to_sqlite.py --derived-only)',
+                  file=sys.stderr)
+        _prebuilt_checked.clear()
+        _prebuilt_checked[mtime] = usable
+    return usable
+
+
+def _prebuilt_sitemap(name):
+    """Risposta static_file per la sitemap precostruita name, o None se manca."""
+    root = sitemaps.SITEMAP_DIR
+    if not os.path.isfile(os.path.join(root, name)) or not _prebuilt_usable(root):
+        return None
+    headers = {'Vary': 'Accept-Encoding', 'Cache-Control': cache_control(daily=False)}
+    # ETag di conditional() (static_file sostituisce gli header della risposta):
+    # debole per la variante .gz, che è un'altra rappresentazione
+    etag = response.get_header('ETag')
+    if ('gzip' in request.environ.get('HTTP_ACCEPT_ENCODING', '')
+            and os.path.isfile(os.path.join(root, name + '.gz'))):
+        name += '.gz'
+        headers['Content-Encoding'] = 'gzip'
+        etag = 'W/' + etag
+    return static_file(name, root=root, mimetype='application/xml; charset=utf-8',
+                       headers=headers, etag=etag)
+
 
 @app.route('/sitemap.xml')
+@conditional()
 def sitemap_index():
+    prebuilt = _prebuilt_sitemap('sitemap.xml')
+    if prebuilt is not None:
+        return prebuilt
     response.content_type = 'application/xml; charset=utf-8'
-    total = db.get_total_cities_with_slug()
-    num_chunks = math.ceil(total / db.SITEMAP_CHUNK)
     return template('sitemap_index',
                     base_url=BASE_URL,
-                    num_chunks=num_chunks)
+                    num_chunks=db.get_sitemap_chunk_count())
 
 
 @app.route('/sitemap-countries.xml')
+@conditional()
 def sitemap_countries():
+    prebuilt = _prebuilt_sitemap('sitemap-countries.xml')
+    if prebuilt is not None:
+        return prebuilt
     response.content_type = 'application/xml; charset=utf-8'
     countries = db.get_all_countries()
     return template('sitemap_countries',
@@ -103,22 +559,40 @@ def sitemap_countries():
 
 
 @app.route('/sitemap-cities-<n:int>.xml')
+@conditional()
 def sitemap_cities(n):
-    total = db.get_total_cities_with_slug()
-    num_chunks = math.ceil(total / db.SITEMAP_CHUNK)
-    if n < 1 or n > num_chunks:
+    prebuilt = _prebuilt_sitemap(f'sitemap-cities-{n}.xml')
+    if prebuilt is not None:
+        return prebuilt
+    cities = db.get_cities_for_sitemap(n)
+    if cities is None:
         abort(404)
     response.content_type = 'application/xml; charset=utf-8'
-    offset = (n - 1) * db.SITEMAP_CHUNK
-    cities = db.get_cities_for_sitemap(offset)
-    return template('sitemap_cities',
-                    base_url=BASE_URL,
-                    cities=cities)
+    return _stream_sitemap_cities(cities)
+
+
+# Righe <url> renderizzate per blocco: la sitemap (fino a 50.000 URL) esce a
+# pezzi e GzipMiddleware la comprime in streaming, senza tenerla tutta in memoria
+SITEMAP_STREAM_BATCH = 1_000
+
+
+def _stream_sitemap_cities(cities):
+    # Blocchi già in byte: Bottle codificherebbe le str leggendo il charset da
+    # response, locale al thread della richiesta (asgi.py avanza i generatori
+    # da altri thread del pool)
+    last = len(cities) - 1
+    for i in range(0, max(len(cities), 1), SITEMAP_STREAM_BATCH):
+        yield template('sitemap_cities',
+                       base_url=BASE_URL,
+                       cities=cities[i:i + SITEMAP_STREAM_BATCH],
+                       head=i == 0,
+                       tail=i + SITEMAP_STREAM_BATCH > last).encode('utf-8')
 
 
 # ── Homepage ──────────────────────────────────────────────────────
 
 @app.route('/')
+@conditional()
 def index():
     continents = db.get_continents()
     return template('index',
@@ -132,6 +606,7 @@ def index():
 # ── Continente ────────────────────────────────────────────────────
 
 @app.route('/continent/<cslug>/')
+@conditional()
 def continent(cslug):
     # Ricostruisce il nome del continente dallo slug
     continent_name = cslug.replace('-', ' ').title()
@@ -151,6 +626,7 @@ def continent(cslug):
 # ── Paese ─────────────────────────────────────────────────────────
 
 @app.route('/country/<cslug>/')
+@conditional()
 def country(cslug):
     country_row = db.get_country(cslug)
     if not country_row:
@@ -167,14 +643,36 @@ def country(cslug):
 
 # ── Regione ───────────────────────────────────────────────────────
 
+def _parse_cursor(value):
+    """Cursore keyset 'cityname,cityid' → (cityname, cityid), oppure None."""
+    if not value or ',' not in value:
+        return None
+    name, cityid = value.rsplit(',', 1)
+    return (name, cityid) if name and cityid else None
+
+
 @app.route('/country/<cslug>/<rslug>/')
+@conditional()
 def region(cslug, rslug):
     region_row = db.get_region(cslug, rslug)
     if not region_row:
         abort(404)
-    page = max(1, int(request.query.get('page', 1)))
-    cities, total = db.get_cities_by_region(cslug, rslug, page=page)
+    page   = max(1, int(request.query.get('page', 1)))
+    after  = _parse_cursor(request.query.get('after'))
+    before = _parse_cursor(request.query.get('before'))
+    cities, total = db.get_cities_by_region(cslug, rslug, page=page,
+                                            after=after, before=before)
     pag = utils.paginate(total, page, per_page=50)
+    # Link prev/next con cursore keyset: nessun OFFSET per chi scorre le pagine
+    pag['prev_qs'] = pag['next_qs'] = ''
+    if pag['has_prev'] and cities and page > 2:
+        first = cities[0]
+        pag['prev_qs'] = '?' + urlencode({'page': page - 1,
+                                          'before': f"{first['cityname']},{first['cityid']}"})
+    if pag['has_next'] and cities:
+        last = cities[-1]
+        pag['next_qs'] = '?' + urlencode({'page': page + 1,
+                                          'after': f"{last['cityname']},{last['cityid']}"})
     region_name = region_row['stateprovince']
     country_name = region_row['countryname']
     return template('region',
@@ -190,6 +688,7 @@ def region(cslug, rslug):
 # ── Ricerca ───────────────────────────────────────────────────────
 
 @app.route('/search')
+@conditional()
 def search():
     q = request.query.get('q', '').strip()
     results = db.search_cities(q) if len(q) >= 2 else []
@@ -210,11 +709,15 @@ def search():
 
 # ── Città ─────────────────────────────────────────────────────────
 
-def _city_base(cslug, rslug, cityslug):
-    """Dati comuni a tutte le pagine di una città."""
-    city_row = db.get_city(cslug, rslug, cityslug)
-    if not city_row:
+def _city_base(cslug, rslug, cityslug, parts=()):
+    """Dati comuni a tutte le pagine di una città, più le parti richieste
+    ('nearby', 'counts') caricate nella stessa transazione (db.load_city_page)."""
+    page = db.load_city_page(cslug, rslug, cityslug, parts)
+    if page is None:
         return None
+    response.set_header('Server-Timing', ', '.join(
+        f'db-{k};dur={v:.2f}' for k, v in page['timings'].items()))
+    city_row = page['city']
 
     lat = city_row['latitude']
     lon = city_row['longitude']
@@ -251,7 +754,7 @@ def _city_base(cslug, rslug, cityslug):
         geo['sunrise'], geo['sunset'], geo['day_length'], geo['sun_date'] = \
             utils.sunrise_sunset(lat, lon)
 
-    return {
+    d = {
         'city': city_row,
         'lat': lat, 'lon': lon, 'has_coords': has_coords,
         'lat_dms': lat_dms, 'lon_dms': lon_dms,
@@ -259,43 +762,48 @@ def _city_base(cslug, rslug, cityslug):
         'country_info': utils.get_country_info(city_row['countrycode']),
         'base_url': BASE_URL,
     }
+    if 'nearby' in parts:
+        d['nearby'] = _with_distances(lat, lon, page['nearby'])
+    if 'counts' in parts:
+        d['region_city_count']  = page['region_city_count']
+        d['country_city_count'] = page['country_city_count']
+    return d
+
+
+def _with_distances(lat, lon, rows):
+    """Città vicine con distanza Haversine (km), escluse quelle coincidenti."""
+    nearby = []
+    for n in rows:
+        if n['latitude'] and n['longitude']:
+            dist = utils.haversine(lat, lon, n['latitude'], n['longitude'])
+            if dist > 0:
+                nearby.append(dict(n) | {'distance_km': dist})
+    return nearby
 
 
 @app.route('/country/<cslug>/<rslug>/<cityslug>/')
+@conditional(daily=True)
 def city(cslug, rslug, cityslug):
-    d = _city_base(cslug, rslug, cityslug)
+    d = _city_base(cslug, rslug, cityslug, parts=('nearby', 'counts'))
     if d is None:
         abort(404)
 
     city_row = d['city']
     lat, lon, has_coords = d['lat'], d['lon'], d['has_coords']
-    nearby = []
     moon   = None
     season = None
 
     if has_coords:
-        nearby_raw = db.get_nearby_cities(lat, lon, city_row['cityid'])
-        for n in nearby_raw:
-            if n['latitude'] and n['longitude']:
-                dist = utils.haversine(lat, lon, n['latitude'], n['longitude'])
-                if dist > 0:
-                    nearby.append(dict(n) | {'distance_km': dist})
         moon   = utils.moon_phase()
         season = utils.current_season(lat)
 
-    region_city_count  = db.get_region_city_count(cslug, rslug)
-    country_city_count = db.get_country_city_count(cslug)
-
     city_name, region_name, country_name = \
         city_row['cityname'], city_row['stateprovince'], city_row['countryname']
 
     return template('city',
                     **d,
-                    nearby=nearby,
                     moon=moon,
                     season=season,
-                    region_city_count=region_city_count,
-                    country_city_count=country_city_count,
                     title=f'{city_name}, {region_name}, {country_name} – '
                           f'GPS Coordinates, Map, Time Zone & Info',
                     description=f'{city_name} is a city in {region_name}, {country_name}. '
@@ -305,6 +813,7 @@ def city(cslug, rslug, cityslug):
 
 
 @app.route('/country/<cslug>/<rslug>/<cityslug>/time/')
+@conditional(daily=True)
 def city_time_page(cslug, rslug, cityslug):
     d = _city_base(cslug, rslug, cityslug)
     if d is None:
@@ -319,6 +828,7 @@ def city_time_page(cslug, rslug, cityslug):
 
 
 @app.route('/country/<cslug>/<rslug>/<cityslug>/sunrise/')
+@conditional(daily=True)
 def city_sunrise_page(cslug, rslug, cityslug):
     d = _city_base(cslug, rslug, cityslug)
     if d is None:
@@ -340,6 +850,7 @@ def city_sunrise_page(cslug, rslug, cityslug):
 
 
 @app.route('/country/<cslug>/<rslug>/<cityslug>/moon/')
+@conditional(daily=True)
 def city_moon_page(cslug, rslug, cityslug):
     d = _city_base(cslug, rslug, cityslug)
     if d is None:
@@ -359,6 +870,7 @@ def city_moon_page(cslug, rslug, cityslug):
 
 
 @app.route('/country/<cslug>/<rslug>/<cityslug>/golden-hour/')
+@conditional(daily=True)
 def city_golden_hour_page(cslug, rslug, cityslug):
     d = _city_base(cslug, rslug, cityslug)
     if d is None:
@@ -371,11 +883,12 @@ def city_golden_hour_page(cslug, rslug, cityslug):
                     **d,
                     golden=golden,
                     title=f'Golden Hour in {cn}, {co} – Photography Times Today',
-                    description=f'Golden hour and blue hour times in {cn}, {co} today. '
+                    description=f'Golden hour, blue hour and twilight times in {cn}, {co} today. '
                                 f'Best photography light windows for sunrise and sunset.')
 
 
 @app.route('/country/<cslug>/<rslug>/<cityslug>/daylight/')
+@conditional(daily=True)
 def city_daylight_page(cslug, rslug, cityslug):
     d = _city_base(cslug, rslug, cityslug)
     if d is None:
@@ -393,26 +906,18 @@ def city_daylight_page(cslug, rslug, cityslug):
 
 
 @app.route('/country/<cslug>/<rslug>/<cityslug>/nearby/')
+@conditional(daily=True)
 def city_nearby_page(cslug, rslug, cityslug):
-    d = _city_base(cslug, rslug, cityslug)
+    d = _city_base(cslug, rslug, cityslug, parts=('nearby',))
     if d is None:
         abort(404)
     city_row = d['city']
-    lat, lon, has_coords = d['lat'], d['lon'], d['has_coords']
-    nearby = []
-    if has_coords:
-        nearby_raw = db.get_nearby_cities(lat, lon, city_row['cityid'])
-        for n in nearby_raw:
-            if n['latitude'] and n['longitude']:
-                dist = utils.haversine(lat, lon, n['latitude'], n['longitude'])
-                if dist > 0:
-                    nearby.append(dict(n) | {'distance_km': dist})
+    nearby = d['nearby']
     cn, co, rn = city_row['cityname'], city_row['countryname'], city_row['stateprovince']
     nearest = nearby[0]['cityname'] if nearby else None
     nearest_km = round(nearby[0]['distance_km']) if nearby else None
     return template('city_nearby',
                     **d,
-                    nearby=nearby,
                     title=f'Cities near {cn}, {co} – Nearest Cities with Distances',
                     description=f'What cities are closest to {cn}, {co}? '
                                 + (f'The nearest city is {nearest}, {nearest_km} km away. ' if nearest else '')
@@ -421,12 +926,26 @@ def city_nearby_page(cslug, rslug, cityslug):
 
 # ── WSGI app (con gzip) ───────────────────────────────────────────
 # Usato da gunicorn/uwsgi: gunicorn "app:application"
-application = GzipMiddleware(app)
+page_cache  = PageCacheMiddleware(app)
+application = GzipMiddleware(page_cache)
+
+# Indice k-NN in memoria costruito all'avvio del worker (o del master con
+# --preload, condiviso copy-on-write), non alla prima richiesta
+if db.NEARBY_INDEX == 'memory':
+    db.get_nearby_index()
+
+# Riscaldamento opzionale (vedi warmup.py): prima del fork con --preload
+if os.environ.get('WARMUP', 'false').lower() == 'true':
+    import warmup
+    warmup.warmup(application)
 
 
 # ── Avvio ─────────────────────────────────────────────────────────
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['export']:
+        import export
+        export.main(app, sys.argv[2:])
     port = int(os.environ.get('PORT', 8080))
     debug = os.environ.get('DEBUG', 'false').lower() == 'true'
     run(application, host='0.0.0.0', port=port, debug=debug, reloader=debug)
@@ -0,0 +1,257 @@
+"""
+asgi.py — Entry point ASGI dell'applicazione.
+
+Uso: uvicorn asgi:application          (o un altro server ASGI)
+     python asgi.py [porta]            (server HTTP/1.1 asyncio incluso)
+
+WSGIToASGI adatta l'app WSGI (app.application, con gzip e cache delle pagine)
+al protocollo ASGI senza dipendenze esterne: ogni richiesta esegue la vista
+(query al DB e rendering) in un pool di ASGI_THREADS thread, quindi al più
+ASGI_THREADS connessioni SQLite, mentre il ciclo asyncio resta libero di
+leggere e scrivere su molte connessioni lente insieme. I corpi in streaming
+(es. le sitemap) sono consumati a blocchi nel pool e inviati man mano.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote
+
+import app
+
+ASGI_THREADS   = int(os.environ.get('ASGI_THREADS', 16))
+HEADER_TIMEOUT = int(os.environ.get('ASGI_HEADER_TIMEOUT', 30))   # secondi
+MAX_BODY       = 1 << 20
+
+
+# ── Adattatore WSGI → ASGI ────────────────────────────────────────
+
+def _environ(scope, body):
+    """Environ WSGI (PEP 3333) per uno scope http ASGI."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD':    scope['method'],
+        'SCRIPT_NAME':       scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO':         scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING':      scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME':       server[0],
+        'SERVER_PORT':       str(server[1]),
+        'SERVER_PROTOCOL':   'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version':      (1, 0),
+        'wsgi.url_scheme':   scope.get('scheme', 'http'),
+        'wsgi.input':        io.BytesIO(body),
+        'wsgi.errors':       sys.stderr,
+        'wsgi.multithread':  True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once':     False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+class WSGIToASGI:
+    """Applicazione ASGI (scope http e lifespan) che esegue wsgi_app nel pool."""
+
+    def __init__(self, wsgi_app, max_threads=ASGI_THREADS):
+        self.app      = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_threads,
+                                           thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        result = await loop.run_in_executor(
+            self.executor, self.app, _environ(scope, bytes(body)), start_response)
+        # Le liste sono già in memoria; i generatori vanno avanzati nel pool
+        in_memory = isinstance(result, (list, tuple))
+        chunks = iter(result)
+
+        async def next_chunk():
+            if in_memory:
+                return next(chunks, None)
+            return await loop.run_in_executor(self.executor, next, chunks, None)
+
+        try:
+            # start_response può arrivare solo al primo blocco
+            chunk = await next_chunk()
+            status, headers = started
+            await send({
+                'type':    'http.response.start',
+                'status':  int(status[:3]),
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                            for k, v in headers],
+            })
+            if chunk is None:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            while chunk is not None:
+                following = await next_chunk()
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': following is not None})
+                chunk = following
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+
+
+application = WSGIToASGI(app.application)
+
+
+# ── Server HTTP/1.1 minimo ────────────────────────────────────────
+# Per `python asgi.py` e per bench.py: keep-alive, corpi con Content-Length,
+# risposte chunked se l'app non indica la lunghezza. In produzione conviene
+# un server ASGI completo (uvicorn, hypercorn) dietro nginx.
+
+async def _handle_connection(asgi_app, reader, writer):
+    sockname = writer.get_extra_info('sockname') or ('localhost', 80)
+    peer = writer.get_extra_info('peername')
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HEADER_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    asyncio.TimeoutError, ConnectionError):
+                return
+            lines = head.decode('latin-1').split('\r\n')
+            try:
+                method, target, version = lines[0].split(' ', 2)
+            except ValueError:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n'
+                             b'Connection: close\r\n\r\n')
+                return
+            headers = []
+            for line in lines[1:]:
+                if line:
+                    name, _, value = line.partition(':')
+                    headers.append((name.strip().lower().encode('latin-1'),
+                                    value.strip().encode('latin-1')))
+            fields = dict(headers)
+            length = int(fields.get(b'content-length', b'0') or 0)
+            if length > MAX_BODY:
+                writer.write(b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\n'
+                             b'Connection: close\r\n\r\n')
+                return
+            body = await reader.readexactly(length) if length else b''
+
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'},
+                'http_version': version[5:], 'method': method.upper(), 'scheme': 'http',
+                'path': unquote(path), 'raw_path': path.encode('latin-1'),
+                'query_string': query.encode('latin-1'), 'root_path': '',
+                'headers': headers, 'server': sockname[:2], 'client': peer[:2] if peer else None,
+            }
+            keep_alive = (version == 'HTTP/1.1'
+                          and fields.get(b'connection', b'').lower() != b'close')
+            state = {'received': False, 'started': False, 'chunked': False,
+                     'keep_alive': keep_alive}
+
+            async def receive():
+                if state['received']:
+                    return {'type': 'http.disconnect'}
+                state['received'] = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    state['started'] = True
+                    status = message['status']
+                    out = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'.encode()]
+                    has_length = False
+                    for k, v in message.get('headers', []):
+                        has_length = has_length or k.lower() == b'content-length'
+                        out.append(k + b': ' + v + b'\r\n')
+                    if (not has_length and method != 'HEAD'
+                            and status not in (204, 304) and status >= 200):
+                        if version == 'HTTP/1.1':
+                            out.append(b'Transfer-Encoding: chunked\r\n')
+                            state['chunked'] = True
+                        else:
+                            state['keep_alive'] = False
+                    out.append(b'Connection: keep-alive\r\n\r\n' if state['keep_alive']
+                               else b'Connection: close\r\n\r\n')
+                    writer.write(b''.join(out))
+                elif message['type'] == 'http.response.body':
+                    data = b'' if method == 'HEAD' else message.get('body', b'')
+                    if state['chunked']:
+                        if data:
+                            writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                        if not message.get('more_body'):
+                            writer.write(b'0\r\n\r\n')
+                    elif data:
+                        writer.write(data)
+                    await writer.drain()
+
+            try:
+                await asgi_app(scope, receive, send)
+            except Exception:
+                traceback.print_exc()
+                if not state['started']:
+                    writer.write(b'HTTP/1.1 500 Internal Server Error\r\n'
+                                 b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+            if not state['keep_alive']:
+                return
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(asgi_app, host='0.0.0.0', port=8080):
+    """Avvia il server sul ciclo corrente e lo restituisce (asyncio.Server)."""
+    return await asyncio.start_server(
+        lambda r, w: _handle_connection(asgi_app, r, w), host, port)
+
+
+def serve(asgi_app, host='0.0.0.0', port=8080):
+    async def main():
+        server = await start_server(asgi_app, host, port)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(main())
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ.get('PORT', 8080))
+    print(f'ASGI su http://0.0.0.0:{port}/ ({ASGI_THREADS} thread)')
+    serve(application, port=port)
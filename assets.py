@@ -0,0 +1,148 @@
+"""
+assets.py — Pipeline degli asset statici.
+
+Uso: python assets.py vendor   → scarica Leaflet e Chart.js in static/vendor/
+     python assets.py build    → genera static/dist/ e static/dist/manifest.json
+
+build copia ogni file di static/ (dist escluso) in static/dist/ sia con il nome
+originale sia con l'hash del contenuto nel nome (style.css → style.1a2b3c4d5e.css),
+più la variante .gz precompressa per i tipi testuali. I template ottengono gli
+URL con asset_url(): il file con hash se il manifest lo conosce (servito da
+app.py con Cache-Control immutable), altrimenti il file originale o, per le
+librerie non ancora scaricate con vendor, la CDN.
+
+Dopo vendor/build va riavviata l'app: il manifest è letto una volta per processo.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import urllib.request
+
+STATIC_ROOT = './static'
+DIST        = 'dist'
+MANIFEST    = 'manifest.json'
+
+# Librerie esterne: percorso sotto static/ → URL della versione fissata
+VENDOR = {
+    'vendor/leaflet/leaflet.js':            'https://unpkg.com/leaflet@1.9.4/dist/leaflet.js',
+    'vendor/leaflet/leaflet.css':           'https://unpkg.com/leaflet@1.9.4/dist/leaflet.css',
+    'vendor/leaflet/images/layers.png':     'https://unpkg.com/leaflet@1.9.4/dist/images/layers.png',
+    'vendor/leaflet/images/layers-2x.png':  'https://unpkg.com/leaflet@1.9.4/dist/images/layers-2x.png',
+    'vendor/leaflet/images/marker-icon.png':    'https://unpkg.com/leaflet@1.9.4/dist/images/marker-icon.png',
+    'vendor/leaflet/images/marker-icon-2x.png': 'https://unpkg.com/leaflet@1.9.4/dist/images/marker-icon-2x.png',
+    'vendor/leaflet/images/marker-shadow.png':  'https://unpkg.com/leaflet@1.9.4/dist/images/marker-shadow.png',
+    'vendor/chartjs/chart.umd.min.js':      'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js',
+}
+
+_COMPRESSIBLE_EXT = ('.css', '.js', '.svg', '.json', '.txt', '.xml', '.html')
+
+# nome.<10 hex>.ext: contenuto immutabile, cacheabile per sempre
+_FINGERPRINT_RE = re.compile(r'\.[0-9a-f]{10}\.[^./]+$')
+
+
+# ── URL per i template ────────────────────────────────────────────
+
+_manifest = None
+
+
+def _load_manifest():
+    try:
+        with open(os.path.join(STATIC_ROOT, DIST, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url(path):
+    """URL pubblico dell'asset path (relativo a static/)."""
+    global _manifest
+    if _manifest is None:
+        _manifest = _load_manifest()
+    if path in _manifest:
+        return f'/static/{DIST}/{_manifest[path]}'
+    if path in VENDOR and not os.path.isfile(os.path.join(STATIC_ROOT, path)):
+        return VENDOR[path]
+    return f'/static/{path}'
+
+
+def manifest_path():
+    """Percorso del manifest (per includerlo nella versione del codice)."""
+    return os.path.join(STATIC_ROOT, DIST, MANIFEST)
+
+
+def is_fingerprinted(filepath):
+    return filepath.startswith(DIST + '/') and bool(_FINGERPRINT_RE.search(filepath))
+
+
+# ── Comandi ───────────────────────────────────────────────────────
+
+def vendor():
+    for path, url in VENDOR.items():
+        target = os.path.join(STATIC_ROOT, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with urllib.request.urlopen(url, timeout=30) as r:
+            data = r.read()
+        with open(target, 'wb') as f:
+            f.write(data)
+        print(f'  {path:<44} {len(data):>9,} byte')
+
+
+def _write(path, data, compress):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if compress:
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+
+
+def build():
+    dist = os.path.join(STATIC_ROOT, DIST)
+    tmp  = dist + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(STATIC_ROOT):
+        if os.path.samefile(dirpath, STATIC_ROOT):
+            dirnames[:] = [d for d in dirnames if d not in (DIST, DIST + '.tmp')]
+        for name in sorted(filenames):
+            if name.endswith('.gz'):
+                continue
+            src = os.path.join(dirpath, name)
+            rel = os.path.relpath(src, STATIC_ROOT).replace(os.sep, '/')
+            with open(src, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(rel)
+            hashed = f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+            compress = ext.lower() in _COMPRESSIBLE_EXT
+            # Anche il nome originale: i riferimenti relativi nei CSS (es. le
+            # immagini di Leaflet) restano validi accanto al file con hash
+            _write(os.path.join(tmp, rel), data, compress)
+            _write(os.path.join(tmp, hashed), data, compress)
+            manifest[rel] = hashed
+    with open(os.path.join(tmp, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    # Sostituzione della vecchia dist con due rename
+    old = dist + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.isdir(dist):
+        os.replace(dist, old)
+    os.replace(tmp, dist)
+    shutil.rmtree(old, ignore_errors=True)
+    for rel, hashed in sorted(manifest.items()):
+        print(f'  {rel:<44} → {DIST}/{hashed}')
+
+
+COMMANDS = {'vendor': vendor, 'build': build}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f'Uso: python assets.py {{{"|".join(COMMANDS)}}}')
+        sys.exit(1)
+    COMMANDS[sys.argv[1]]()
@@ -0,0 +1,543 @@
+"""
+bench.py — Benchmark delle query e dei calcoli più frequenti.
+
+Uso: python bench.py nearby [n_campioni]
+     python bench.py search [n_ricerche] [n_thread]
+     python bench.py citypage [n_campioni]
+     python bench.py gzip [n_ripetizioni]
+     python bench.py asgi [secondi] [n_client] [n_client_lenti]
+     python bench.py solar [n_coordinate]
+     python bench.py daycache [n_thread] [n_giri]
+
+Il DB è quello indicato da CITIES_DB (default cities.db), come per app.py.
+Per risultati significativi va usato il dataset mondiale completo.
+"""
+
+import asyncio
+import gzip
+import http.client
+import io
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+import db
+
+
+# ── Utilità ───────────────────────────────────────────────────────
+
+def _percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, int(round(p / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+
+def _measure(fn, args_list):
+    """Esegue fn(*args) per ogni elemento e restituisce i tempi ordinati in µs."""
+    times = []
+    for args in args_list:
+        t0 = time.perf_counter()
+        fn(*args)
+        times.append((time.perf_counter() - t0) * 1e6)
+    times.sort()
+    return times
+
+
+def _report(label, times):
+    print(f'  {label:<28} p50 {_percentile(times, 50):>9.1f} µs   '
+          f'p99 {_percentile(times, 99):>9.1f} µs   n={len(times):,}')
+
+
+def _sample_cities(n):
+    with db.get_conn() as conn:
+        rows = conn.execute('''
+            SELECT cityid, latitude, longitude
+            FROM   cities
+            WHERE  cityname != '' AND latitude IS NOT NULL AND longitude IS NOT NULL
+        ''').fetchall()
+    random.seed(42)
+    return [tuple(r) for r in random.sample(rows, min(n, len(rows)))]
+
+
+# ── Città vicine ──────────────────────────────────────────────────
+
+# Query precedente all'indice R*Tree (scan su idx_coords), per confronto
+_NEARBY_BBOX_SQL = '''
+    SELECT cityid, cityname, stateprovince, countryname,
+           slug_city, slug_country, slug_region,
+           latitude, longitude,
+           ((latitude  - ?) * (latitude  - ?) +
+            (longitude - ?) * (longitude - ?)) AS dist_sq
+    FROM   cities
+    WHERE  latitude  BETWEEN ? AND ?
+      AND  longitude BETWEEN ? AND ?
+      AND  cityname  != ''
+      AND  latitude  IS NOT NULL
+      AND  longitude IS NOT NULL
+      AND  cityid    != ?
+    ORDER  BY dist_sq
+    LIMIT  ?
+'''
+
+
+def _nearby_bbox(cityid, lat, lon, limit=12, radius_deg=2.0):
+    with db.get_conn() as conn:
+        return conn.execute(_NEARBY_BBOX_SQL, (
+            lat, lat, lon, lon,
+            lat - radius_deg, lat + radius_deg,
+            lon - radius_deg, lon + radius_deg,
+            cityid, limit,
+        )).fetchall()
+
+
+def _nearby_rtree(cityid, lat, lon):
+    return db.get_nearby_cities(lat, lon, cityid)
+
+
+def _nearby_memory(cityid, lat, lon):
+    return db._nearby_cities_memory(db.get_conn(), lat, lon, cityid, 12)
+
+
+def bench_nearby(n=2000):
+    sample = _sample_cities(n)
+    print(f'get_nearby_cities — {len(sample):,} città casuali')
+
+    mismatches = sum(
+        [r['cityid'] for r in _nearby_bbox(*c)] != [r['cityid'] for r in _nearby_rtree(*c)]
+        for c in sample[:200]
+    )
+    if mismatches:
+        print(f'  ATTENZIONE: {mismatches} risultati diversi su 200')
+
+    # Un giro di riscaldamento per avere la page cache calda su entrambe
+    _measure(_nearby_bbox, sample)
+    _measure(_nearby_rtree, sample)
+    _report('bbox su idx_coords', _measure(_nearby_bbox, sample))
+    _report('R*Tree', _measure(_nearby_rtree, sample))
+
+    t0 = time.perf_counter()
+    index = db.get_nearby_index()
+    print(f'  indice in memoria: {len(index):,} città, {index.nbytes() / 2**20:.1f} MiB, '
+          f'costruito in {time.perf_counter() - t0:.2f}s')
+    _report('k-NN in memoria (esatto)', _measure(_nearby_memory, sample))
+
+
+# ── Ricerca ───────────────────────────────────────────────────────
+
+# Obiettivo per /search: p99 della query sotto SEARCH_P99_TARGET_MS con
+# SEARCH_THREADS thread concorrenti sul dataset completo
+SEARCH_P99_TARGET_MS = 25
+SEARCH_THREADS       = 8
+
+# Query precedente all'indice FTS5 (LIKE '%q%' = scansione completa), per confronto
+_SEARCH_LIKE_SQL = '''
+    SELECT cityname, stateprovince, countryname, countrycode,
+           slug_city, slug_country, slug_region
+    FROM   cities
+    WHERE  cityname LIKE ? AND cityname != ''
+      AND  slug_city != '' AND slug_country != '' AND slug_region != ''
+    ORDER  BY cityname
+    LIMIT  ?
+'''
+
+
+def _search_like(q, limit=30):
+    with db.get_conn() as conn:
+        return conn.execute(_SEARCH_LIKE_SQL, (f'%{q}%', limit)).fetchall()
+
+
+def _search_terms(n):
+    """Prefissi e sottostringhe (2–6 caratteri) di nomi reali, come da digitazione."""
+    with db.get_conn() as conn:
+        names = [r[0] for r in conn.execute(
+            "SELECT cityname FROM cities WHERE length(cityname) >= 6")]
+    random.seed(7)
+    terms = []
+    for name in random.sample(names, min(n, len(names))):
+        size = random.randint(2, 6)
+        start = 0 if random.random() < 0.5 else random.randint(0, len(name) - size)
+        terms.append(name[start:start + size])
+    return terms
+
+
+def _measure_concurrent(fn, terms, n_threads):
+    """Distribuisce i termini su n_threads thread; restituisce (tempi µs ordinati, ricerche/s)."""
+    times = []
+    lock = threading.Lock()
+
+    def worker(chunk):
+        local = _measure(fn, [(t,) for t in chunk])
+        with lock:
+            times.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(terms[i::n_threads],))
+               for i in range(n_threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    times.sort()
+    return times, len(terms) / elapsed
+
+
+def bench_search(n=500, n_threads=SEARCH_THREADS):
+    terms = _search_terms(n)
+    print(f'search_cities — {len(terms):,} ricerche su {n_threads} thread')
+    for label, fn in (('LIKE %q% (scansione)', _search_like),
+                      ('prefisso + FTS5 trigram', db.search_cities)):
+        times, qps = _measure_concurrent(fn, terms, n_threads)
+        _report(label, times)
+        print(f'  {"":<28} {qps:,.0f} ricerche/s')
+    p99_ms = _percentile(times, 99) / 1000
+    esito = 'OK' if p99_ms <= SEARCH_P99_TARGET_MS else 'NON RAGGIUNTO'
+    print(f'  obiettivo p99 <= {SEARCH_P99_TARGET_MS} ms: {esito} ({p99_ms:.1f} ms, '
+          f'{os.cpu_count()} CPU)')
+
+    # Primo tasto (2 caratteri), senza cache e senza concorrenza: solo intervallo
+    # dell'indice NOCASE, nessuna scansione di cities
+    short = [(t,) for t in terms if len(t) == 2]
+    db.clear_caches()
+    _report('2 caratteri, 1 thread', _measure(db.search_cities, short))
+
+
+# ── Pagina città ──────────────────────────────────────────────────
+
+def _city_slugs(n):
+    with db.get_conn() as conn:
+        rows = conn.execute('''
+            SELECT slug_country, slug_region, slug_city
+            FROM   cities
+            WHERE  cityname != '' AND slug_city != ''
+        ''').fetchall()
+    random.seed(11)
+    return [tuple(r) for r in random.sample(rows, min(n, len(rows)))]
+
+
+def _city_page_sequential(cslug, rslug, cityslug):
+    # Sequenza di chiamate della vista city() prima di load_city_page
+    city = db.get_city(cslug, rslug, cityslug)
+    if city['latitude'] and city['longitude']:
+        db.get_nearby_cities(city['latitude'], city['longitude'], city['cityid'])
+    db.get_region_city_count(cslug, rslug)
+    db.get_country_city_count(cslug)
+
+
+def bench_citypage(n=2000):
+    sample = _city_slugs(n)
+    print(f'dati pagina città — {len(sample):,} città casuali')
+    _measure(_city_page_sequential, sample)     # pagine SQLite in memoria
+    # Stesso stato delle cache di risultati per i due lati: vuote, poi piene
+    for label, fn in (('vista, 4 chiamate', _city_page_sequential),
+                      ('load_city_page', db.load_city_page)):
+        db.clear_caches()
+        _report(f'{label} (miss)', _measure(fn, sample))
+        _report(f'{label} (hit)', _measure(fn, sample))
+
+
+# ── Compressione gzip ─────────────────────────────────────────────
+
+class _BufferedGzip:
+    """GzipMiddleware precedente allo streaming (corpo intero + GzipFile), per confronto."""
+
+    def __init__(self, wsgi_app, min_size=512):
+        self.app      = wsgi_app
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        captured = []
+
+        def fake_start(status, headers, exc_info=None):
+            captured[:] = [status, list(headers)]
+
+        body = b''.join(self.app(environ, fake_start))
+        status, headers = captured
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as gz:
+            gz.write(body)
+        compressed = buf.getvalue()
+        new_headers = [(k, v) for k, v in headers if k.lower() != 'content-length']
+        new_headers += [('Content-Encoding', 'gzip'),
+                        ('Content-Length',   str(len(compressed))),
+                        ('Vary',             'Accept-Encoding')]
+        start_response(status, new_headers)
+        return [compressed]
+
+
+def _gzip_request(wsgi_app, path, trace=False):
+    """Esegue una GET; restituisce (TTFB µs, tempo totale µs, byte, picco memoria KiB).
+    Il picco è misurato solo con trace=True (tracemalloc falsa i tempi)."""
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+               'SERVER_NAME': 'bench', 'SERVER_PORT': '80', 'HTTP_ACCEPT_ENCODING': 'gzip',
+               'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr}
+    if trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    ttfb = None
+    size = 0
+    body = wsgi_app(environ, lambda status, headers, exc_info=None: None)
+    for chunk in body:
+        if ttfb is None and chunk:
+            ttfb = time.perf_counter() - t0
+        size += len(chunk)
+    if hasattr(body, 'close'):
+        body.close()
+    total = time.perf_counter() - t0
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return ttfb * 1e6, total * 1e6, size, peak / 1024
+
+
+def bench_gzip(n=5):
+    import app
+    path = '/sitemap-cities-1.xml'
+    modes = (('buffer + GzipFile', _BufferedGzip(app.app)),
+             ('streaming compressobj', app.GzipMiddleware(app.app, max_bytes=0)),
+             ('cache compressi (hit)', app.GzipMiddleware(app.app)))
+    print(f'GzipMiddleware — GET {path}, {n} ripetizioni')
+    for _, wsgi_app in modes:
+        _gzip_request(wsgi_app, path)           # riscaldamento (cache DB, template, gzip)
+    for label, wsgi_app in modes:
+        runs = [_gzip_request(wsgi_app, path) for _ in range(n)]
+        ttfb  = sorted(r[0] for r in runs)
+        total = sorted(r[1] for r in runs)
+        print(f'  {label:<24} TTFB p50 {_percentile(ttfb, 50) / 1000:>7.2f} ms   '
+              f'totale p50 {_percentile(total, 50) / 1000:>7.2f} ms   '
+              f'picco {_gzip_request(wsgi_app, path, trace=True)[3]:>8,.0f} KiB   '
+              f'{runs[0][2]:,} byte')
+
+
+# ── WSGI / ASGI ───────────────────────────────────────────────────
+
+# Un client lento invia la richiesta un byte ogni SLOW_BYTE_DELAY secondi
+SLOW_BYTE_DELAY = 0.01
+
+
+def _serve_wsgi():
+    """wsgiref a thread singolo, come `python app.py`; restituisce (porta, stop)."""
+    from wsgiref.simple_server import make_server, WSGIRequestHandler
+    import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = make_server('127.0.0.1', 0, app.application, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_port, server.shutdown
+
+
+def _serve_asgi():
+    """Server asyncio di asgi.py in un thread; restituisce (porta, stop)."""
+    import asgi
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asgi.start_server(asgi.application, '127.0.0.1', 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server.sockets[0].getsockname()[1], lambda: loop.call_soon_threadsafe(loop.stop)
+
+
+def _http_load(port, urls, seconds, n_clients, n_slow):
+    """n_clients client keep-alive più n_slow client lenti per seconds secondi;
+    restituisce (tempi µs ordinati dei client veloci, richieste/s)."""
+    stop = time.perf_counter() + seconds
+    times = []
+    lock = threading.Lock()
+
+    def fast(i):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        local = []
+        j = i
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            conn.request('GET', urls[j % len(urls)], headers={'Accept-Encoding': 'gzip'})
+            conn.getresponse().read()
+            local.append((time.perf_counter() - t0) * 1e6)
+            j += n_clients
+        conn.close()
+        with lock:
+            times.extend(local)
+
+    def slow(i):
+        req = (f'GET {urls[i % len(urls)]} HTTP/1.1\r\nHost: bench\r\n'
+               f'Connection: close\r\n\r\n').encode()
+        while time.perf_counter() < stop:
+            with socket.create_connection(('127.0.0.1', port), timeout=120) as s:
+                for b in req:
+                    s.sendall(bytes([b]))
+                    time.sleep(SLOW_BYTE_DELAY)
+                while s.recv(65536):
+                    pass
+
+    threads = ([threading.Thread(target=fast, args=(i,)) for i in range(n_clients)]
+               + [threading.Thread(target=slow, args=(i,)) for i in range(n_slow)])
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    times.sort()
+    return times, len(times) / (time.perf_counter() - t0)
+
+
+def bench_asgi(seconds=5, n_clients=16, n_slow=4):
+    urls = [f'/country/{c}/{r}/{s}/' for c, r, s in _city_slugs(2000)]
+    print(f'pagina città via HTTP — {seconds}s per prova, {n_clients} client keep-alive')
+    for label, serve in (('WSGI (wsgiref)', _serve_wsgi), ('ASGI (asgi.py)', _serve_asgi)):
+        port, stop = serve()
+        _http_load(port, urls, 1, n_clients, 0)           # riscaldamento
+        for slow in (0, n_slow):
+            times, rps = _http_load(port, urls, seconds, n_clients, slow)
+            _report(f'{label}, {slow} lenti', times)
+            print(f'  {"":<28} {rps:,.0f} richieste/s')
+        stop()
+
+
+# ── Calcoli solari ────────────────────────────────────────────────
+
+# Latitudini estreme (sole di mezzanotte, notte polare, poli) oltre al campione
+_SOLAR_EXTRA = [(90.0, 0.0), (-90.0, 0.0), (78.2, 15.6), (-77.8, 166.7), (66.6, 25.7)]
+_SOLAR_ELEVATIONS = [-18.0, -12.0, -6.0, -4.0, -0.833, 6.0]
+
+
+def _py_terms_formula(lat, lon, N, sin_h0):
+    """solar._py_terms prima delle tabelle per giorno: tutto ricalcolato da N."""
+    import math
+    decl = 23.45 * math.sin(math.radians(360 / 365 * (N - 81)))
+    cos_H_num = sin_h0 - math.sin(math.radians(lat)) * math.sin(math.radians(decl))
+    cos_H_den = math.cos(math.radians(lat)) * math.cos(math.radians(decl))
+    B = math.radians(360 / 365 * (N - 81))
+    EoT = 9.87 * math.sin(2 * B) - 7.53 * math.cos(B) - 1.5 * math.sin(B)
+    solar_noon = 12 - lon / 15 - EoT / 60
+    if cos_H_den == 0:
+        return None, 0, solar_noon
+    return cos_H_num / cos_H_den, cos_H_den, solar_noon
+
+
+def _solar_diff(a, b):
+    """Massima differenza fra due liste di orari; inf se i None non coincidono."""
+    worst = 0.0
+    for x, y in zip(a, b):
+        if (x is None) != (y is None):
+            return float('inf')
+        if x is not None:
+            d = abs(x - y)
+            worst = max(worst, min(d, 24 - d))      # 23.9999… ≡ 0.0000…
+    return worst
+
+
+def bench_solar(n=500):
+    import solar
+    coords = [(lat, lon) for _, lat, lon in _sample_cities(n)] + _SOLAR_EXTRA
+    days = list(range(1, 367))
+    engines = ['python'] + (['numpy'] if solar.np is not None else [])
+    print(f'solar — {len(coords):,} coordinate × {len(days)} giorni, motori: {", ".join(engines)}')
+
+    if 'numpy' in engines:
+        worst, status_mismatch = 0.0, 0
+        for lat, lon in coords:
+            py = solar.sun_times(lat, lon, days, engine='python')
+            vn = solar.sun_times(lat, lon, days, engine='numpy')
+            status_mismatch += sum(a != b for a, b in zip(py[3], vn[3]))
+            worst = max(worst, *(_solar_diff(a, b) for a, b in zip(py[:3], vn[:3])))
+            for elev in _SOLAR_ELEVATIONS:
+                py = solar.elevation_times(lat, lon, days, elev, engine='python')
+                vn = solar.elevation_times(lat, lon, days, elev, engine='numpy')
+                worst = max(worst, _solar_diff(py[0], vn[0]), _solar_diff(py[1], vn[1]))
+        ok = worst < 1e-9 and not status_mismatch
+        print(f'  equivalenza python/numpy: differenza max {worst:.2e} h, '
+              f'{status_mismatch} esiti diversi → {"OK" if ok else "DIVERSI"}')
+    else:
+        print('  NumPy non installato: equivalenza non verificata')
+
+    for engine in engines:
+        _report(f'{engine}: 366 giorni', _measure(
+            lambda lat, lon: solar.sun_times(lat, lon, days, engine=engine), coords))
+        _report(f'{engine}: 6 soglie', _measure(
+            lambda lat, lon: solar.elevation_times(lat, lon, 172, _SOLAR_ELEVATIONS,
+                                                   engine=engine), coords))
+        if engine == 'python':
+            _report('python: 6 soglie, 1 passata', _measure(
+                lambda lat, lon: solar.elevation_crossings(lat, lon, 172, _SOLAR_ELEVATIONS),
+                coords))
+        lats, lons = [c[0] for c in coords], [c[1] for c in coords]
+        _report(f'{engine}: tutte le coordinate', _measure(
+            lambda: solar.sun_times(lats, lons, 172, engine=engine), [()] * 20))
+
+    # Funzioni di pagina (senza cache giornaliera), motore Python: tabelle per
+    # giorno contro declinazione ed equazione del tempo ricalcolate a ogni giorno
+    # (USE_NUMPY spento: le funzioni di pagina devono usare il motore Python)
+    import utils
+    tables, use_numpy = solar._py_terms, solar.USE_NUMPY
+    for label, terms in (('formula', _py_terms_formula), ('tabelle', tables)):
+        solar._py_terms, solar.USE_NUMPY = terms, False
+        try:
+            _report(f'sun_calendar, {label}', _measure(utils._compute_sun_calendar, coords))
+            _report(f'annual_daylight, {label}', _measure(utils._compute_annual_daylight, coords))
+            _report(f'sun_times 366 g, {label}', _measure(
+                lambda lat, lon: solar.sun_times(lat, lon, days, engine='python'), coords))
+        finally:
+            solar._py_terms, solar.USE_NUMPY = tables, use_numpy
+
+
+# ── Cache giornaliera ─────────────────────────────────────────────
+
+def bench_daycache(n_threads=32, rounds=20):
+    """Simula il cambio di giorno: n_threads chiedono insieme una chiave nuova,
+    il cui calcolo (build_moon_calendar più 50 ms, come sotto carico) li vede
+    arrivare tutti. Misura l'attesa; la correttezza del single-flight è in
+    tests/test_day_cache.py."""
+    import utils
+    computed = []
+
+    def compute():
+        computed.append(threading.get_ident())
+        time.sleep(0.05)
+        return utils._compute_moon_calendar()
+
+    print(f'_day_cache — {rounds} giri, {n_threads} thread sulla stessa chiave nuova')
+    times = []
+    for r in range(rounds):
+        barrier = threading.Barrier(n_threads)
+
+        def worker():
+            barrier.wait()
+            t0 = time.perf_counter()
+            utils._day_cache(('bench_daycache', r), compute)
+            times.append((time.perf_counter() - t0) * 1e6)
+
+        threads = [threading.Thread(target=worker) for _ in range(n_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    times.sort()
+    _report('attesa per chiamata', times)
+    print(f'  calcoli eseguiti: {len(computed)} su {rounds * n_threads} chiamate')
+    print(f'  {utils.day_cache_stats()}')
+
+
+BENCHMARKS = {
+    'nearby':   bench_nearby,
+    'search':   bench_search,
+    'citypage': bench_citypage,
+    'gzip':     bench_gzip,
+    'asgi':     bench_asgi,
+    'solar':    bench_solar,
+    'daycache': bench_daycache,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f'Uso: python bench.py {{{"|".join(BENCHMARKS)}}} [n_campioni]')
+        sys.exit(1)
+    fn = BENCHMARKS[sys.argv[1]]
+    fn(*(int(a) for a in sys.argv[2:]))
@@ -1,10 +1,17 @@
 """
 Importa worldcities-geo.csv in cities.db (SQLite).
 Uso: python csv_to_sqlite.py [percorso_csv] [percorso_db]
+     python csv_to_sqlite.py --derived-only [percorso_csv] [percorso_db]
 
 Default:
   CSV → worldcities-geo.csv
   DB  → cities.db
+
+Dopo l'importazione vengono ricostruite le tabelle derivate (riepiloghi per
+continente/paese/regione, indice R*Tree delle coordinate, indice di ricerca
+FTS5, blocchi delle sitemap) e i file sitemap in SITEMAP_DIR. Con
+--derived-only il CSV non viene letto e si ricostruiscono solo quelle (un DB
+creato senza cities.id viene prima migrato).
 """
 
 import sqlite3
@@ -14,11 +21,17 @@ import re
 import sys
 import time
 
+from sitemaps import build_sitemaps
+
 
-CSV_PATH = sys.argv[1] if len(sys.argv) > 1 else 'worldcities-geo.csv'
-DB_PATH  = sys.argv[2] if len(sys.argv) > 2 else 'cities.db'
+ARGS     = [a for a in sys.argv[1:] if not a.startswith('--')]
+CSV_PATH = ARGS[0] if len(ARGS) > 0 else 'worldcities-geo.csv'
+DB_PATH  = ARGS[1] if len(ARGS) > 1 else 'cities.db'
 BATCH    = 5_000
 
+# URL per file sitemap-cities-N.xml (limite del protocollo sitemap: 50.000)
+SITEMAP_CHUNK = 50_000
+
 
 # ── Helpers ───────────────────────────────────────────────────────
 
@@ -39,11 +52,31 @@ def parse_float(val):
 
 
 # ── Schema ────────────────────────────────────────────────────────
+# id è un alias esplicito del rowid: a differenza del rowid implicito resta
+# stabile dopo VACUUM, e R*Tree, FTS5 e sitemap_chunks vi fanno riferimento.
+
+COLUMNS = ('cityid', 'regionid', 'countryid', 'countryname', 'countrycode', 'continent',
+           'stateprovince', 'cityname', 'latitude', 'longitude',
+           'slug_city', 'slug_country', 'slug_region')
+
+
+def _needs_id_migration(conn):
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(cities)')]
+    return bool(cols) and 'id' not in cols
+
 
 def init_db(conn):
+    # DB creati prima di cities.id: la tabella è ricopiata con id = rowid attuale,
+    # così le tabelle derivate esistenti restano coerenti fino alla ricostruzione
+    migrate = _needs_id_migration(conn)
+    if migrate:
+        print('Migrazione: cities.id INTEGER PRIMARY KEY dai rowid attuali')
+        conn.execute('BEGIN')
+        conn.execute('ALTER TABLE cities RENAME TO cities_old')
     conn.execute('''
         CREATE TABLE IF NOT EXISTS cities (
-            cityid        TEXT PRIMARY KEY,
+            id            INTEGER PRIMARY KEY,
+            cityid        TEXT NOT NULL UNIQUE,
             regionid      TEXT,
             countryid     TEXT,
             countryname   TEXT,
@@ -58,6 +91,10 @@ def init_db(conn):
             slug_region   TEXT
         )
     ''')
+    if migrate:
+        cols = ', '.join(COLUMNS)
+        conn.execute(f'INSERT INTO cities (id, {cols}) SELECT rowid, {cols} FROM cities_old')
+        conn.execute('DROP TABLE cities_old')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_country ON cities(slug_country)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_region  ON cities(slug_country, slug_region)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_city    ON cities(slug_country, slug_region, slug_city)')
@@ -66,6 +103,146 @@ def init_db(conn):
     conn.commit()
 
 
+# ── Tabelle derivate ──────────────────────────────────────────────
+# Riepiloghi materializzati letti da db.py al posto dei GROUP BY su cities.
+# Vanno ricostruiti dopo ogni modifica a cities (import, fix_regions --apply).
+
+def build_summary_tables(conn):
+    conn.execute('DROP TABLE IF EXISTS continent_summary')
+    conn.execute('''
+        CREATE TABLE continent_summary (
+            continent     TEXT PRIMARY KEY,
+            city_count    INTEGER NOT NULL,
+            country_count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO continent_summary
+        SELECT continent, COUNT(*), COUNT(DISTINCT countrycode)
+        FROM   cities
+        WHERE  continent != '' AND cityname != ''
+        GROUP  BY continent
+    ''')
+
+    conn.execute('DROP TABLE IF EXISTS country_summary')
+    conn.execute('''
+        CREATE TABLE country_summary (
+            countrycode  TEXT PRIMARY KEY,
+            countryname  TEXT,
+            slug_country TEXT,
+            continent    TEXT,
+            city_count   INTEGER NOT NULL,
+            region_count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO country_summary
+        SELECT countrycode, countryname, slug_country, continent,
+               SUM(cityname != ''),
+               COUNT(DISTINCT CASE WHEN cityname != '' THEN regionid END)
+        FROM   cities
+        GROUP  BY countrycode
+    ''')
+    conn.execute('CREATE INDEX idx_country_summary_slug ON country_summary(slug_country)')
+    conn.execute('CREATE INDEX idx_country_summary_cont ON country_summary(continent, countryname)')
+
+    conn.execute('DROP TABLE IF EXISTS region_summary')
+    conn.execute('''
+        CREATE TABLE region_summary (
+            slug_country  TEXT,
+            slug_region   TEXT,
+            stateprovince TEXT,
+            countryname   TEXT,
+            continent     TEXT,
+            city_count    INTEGER NOT NULL,
+            PRIMARY KEY (slug_country, slug_region)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO region_summary
+        SELECT slug_country, slug_region, stateprovince, countryname, continent,
+               SUM(cityname != '')
+        FROM   cities
+        GROUP  BY slug_country, slug_region
+    ''')
+
+
+def build_listing_index(conn):
+    # Indice coprente per le liste città per regione (paginazione keyset)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_region_list
+        ON cities(slug_country, slug_region, cityname, cityid, slug_city, latitude, longitude)
+    ''')
+
+
+def build_spatial_index(conn):
+    # R*Tree sulle coordinate: id = cities.id, box degenere (punto)
+    conn.execute('DROP TABLE IF EXISTS cities_rtree')
+    conn.execute('''
+        CREATE VIRTUAL TABLE cities_rtree USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO cities_rtree
+        SELECT id, latitude, latitude, longitude, longitude
+        FROM   cities
+        WHERE  cityname != '' AND latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+
+
+def build_search_index(conn):
+    # Indice full-text trigram (content esterno: nessuna copia dei nomi) per le
+    # ricerche per sottostringa; indice NOCASE per quelle per prefisso
+    conn.execute('DROP TABLE IF EXISTS cities_fts')
+    conn.execute('''
+        CREATE VIRTUAL TABLE cities_fts USING fts5(
+            cityname, content='cities', content_rowid='id', tokenize='trigram'
+        )
+    ''')
+    conn.execute("INSERT INTO cities_fts(cities_fts) VALUES ('rebuild')")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cityname ON cities(cityname COLLATE NOCASE)')
+
+
+def build_sitemap_chunks(conn):
+    # Blocchi da SITEMAP_CHUNK città con slug completi, per intervalli di id
+    conn.execute('DROP TABLE IF EXISTS sitemap_chunks')
+    conn.execute('''
+        CREATE TABLE sitemap_chunks (
+            chunk     INTEGER PRIMARY KEY,
+            min_id    INTEGER NOT NULL,
+            max_id    INTEGER NOT NULL,
+            url_count INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO sitemap_chunks
+        SELECT chunk + 1, MIN(id), MAX(id), COUNT(*)
+        FROM (
+            SELECT id, (ROW_NUMBER() OVER (ORDER BY id) - 1) / ? AS chunk
+            FROM   cities
+            WHERE  cityname != '' AND slug_city != ''
+              AND  slug_country != '' AND slug_region != ''
+        )
+        GROUP  BY chunk
+    ''', (SITEMAP_CHUNK,))
+
+
+def build_derived_tables(conn):
+    """Ricostruisce tutte le tabelle derivate da cities in un'unica transazione,
+    poi i file sitemap (vedi sitemaps.py)."""
+    init_db(conn)       # schema aggiornato anche per --derived-only e fix_regions
+    start = time.time()
+    with conn:
+        build_summary_tables(conn)
+        build_listing_index(conn)
+        build_spatial_index(conn)
+        build_search_index(conn)
+        build_sitemap_chunks(conn)
+    print(f'Tabelle derivate ricostruite in {time.time() - start:.1f}s')
+    build_sitemaps(conn)
+
+
 # ── Importazione ──────────────────────────────────────────────────
 
 def run():
@@ -80,8 +257,9 @@ def run():
     total   = 0
     skipped = 0
 
-    INSERT = '''
-        INSERT OR IGNORE INTO cities VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+    INSERT = f'''
+        INSERT OR IGNORE INTO cities ({', '.join(COLUMNS)})
+        VALUES ({', '.join('?' * len(COLUMNS))})
     '''
 
     with open(CSV_PATH, encoding='utf-8') as f:
@@ -123,10 +301,18 @@ def run():
         conn.commit()
         total += len(batch)
 
-    conn.close()
     elapsed = time.time() - start
     print(f'\nImportazione completata: {total:,} righe in {elapsed:.1f}s  ({skipped} skipped)')
 
+    build_derived_tables(conn)
+    conn.close()
+
 
 if __name__ == '__main__':
-    run()
+    if '--derived-only' in sys.argv:
+        print(f'Database     : {DB_PATH}')
+        conn = sqlite3.connect(DB_PATH)
+        build_derived_tables(conn)
+        conn.close()
+    else:
+        run()
@@ -1,60 +1,330 @@
+import functools
 import sqlite3
 import os
+import pathlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import geoindex
 
 DB_PATH = os.environ.get('CITIES_DB', 'cities.db')
 
+# Modalità di servizio in sola lettura (CITIES_DB_READONLY=1): il file viene
+# aperto con mode=ro&immutable=1, quindi SQLite non prende lock né controlla
+# modifiche, e le pagine sono lette via mmap dalla page cache del sistema
+# operativo, condivisa tra tutti i worker gunicorn.
+# ATTENZIONE: con immutable=1 il file non deve cambiare mentre l'app gira;
+# dopo csv_to_sqlite.py o fix_regions.py --apply i worker vanno riavviati.
+#
+# Misura indicativa (DB sintetico da 16k righe, page cache calda, 1 thread):
+#   get_city                 ~20 µs  →  ~16 µs
+#   get_nearby_cities        ~125 µs →  ~124 µs
+# Il guadagno principale è l'assenza di lock con molti worker concorrenti.
+READONLY  = os.environ.get('CITIES_DB_READONLY', 'false').lower() in ('1', 'true', 'yes')
+MMAP_SIZE = int(os.environ.get('CITIES_DB_MMAP_SIZE', 1 << 30))     # byte
+CACHE_KIB = int(os.environ.get('CITIES_DB_CACHE_KIB', 64 * 1024))   # page cache per connessione
+
+# Motore per get_nearby_cities: 'sql' (R*Tree, default) oppure 'memory'
+# (indice k-NN in memoria costruito una volta per processo, vedi geoindex.py)
+NEARBY_INDEX = os.environ.get('CITIES_NEARBY_INDEX', 'sql').lower()
+
+# Cache LRU dei risultati delle query (CITIES_RESULT_CACHE=0 per disattivarla)
+RESULT_CACHE = os.environ.get('CITIES_RESULT_CACHE', 'true').lower() not in ('0', 'false', 'no')
+# Secondi tra due controlli di modifica del file DB (invalidazione della cache)
+CACHE_CHECK_INTERVAL = float(os.environ.get('CITIES_CACHE_CHECK_INTERVAL', 1.0))
+
+# Statement preparati tenuti in cache da ogni connessione (default sqlite3: 128)
+CACHED_STATEMENTS = int(os.environ.get('CITIES_DB_CACHED_STATEMENTS', 256))
+
+
+# ── Connessioni persistenti per thread ────────────────────────────
+# Una connessione per thread, riusata tra le richieste: schema e statement
+# preparati restano in memoria. Dopo un fork (worker gunicorn) la connessione
+# ereditata dal master resta aperta ma inutilizzata, e il figlio ne apre una sua.
+
+class _PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection con supporto weakref (per il conteggio in pool_stats)."""
+
+
+_local      = threading.local()
+_live       = weakref.WeakSet()
+_stats_lock = threading.Lock()
+_stats      = {'opened': 0, 'reused': 0, 'retired': 0}
+# Incrementata quando il file del DB cambia: le connessioni aperte con una
+# generazione precedente leggono ancora il vecchio file e vanno riaperte
+_conn_generation = 0
+
+
+def _open_conn():
+    if READONLY:
+        uri = pathlib.Path(DB_PATH).resolve().as_uri() + '?mode=ro&immutable=1'
+        conn = sqlite3.connect(uri, uri=True,
+                               factory=_PooledConnection,
+                               cached_statements=CACHED_STATEMENTS)
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size = -{CACHE_KIB}')
+        conn.execute('PRAGMA query_only = 1')
+    else:
+        conn = sqlite3.connect(DB_PATH,
+                               factory=_PooledConnection,
+                               cached_statements=CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    return conn
+
 
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """Connessione SQLite del thread corrente (aperta al primo uso, poi riusata).
+    Se nel frattempo il file del DB è stato sostituito (vedi _check_db_changed)
+    la connessione viene riaperta sul nuovo file."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.generation == _conn_generation:
+        with _stats_lock:
+            _stats['reused'] += 1
+        return conn
+
+    if conn is not None:
+        # Connessione al file precedente: non si chiude qui, perché il chiamante
+        # potrebbe averla ancora in uso in una transazione aperta; si chiude
+        # quando l'ultimo riferimento viene rilasciato
+        with _stats_lock:
+            _live.discard(conn)
+            _stats['retired'] += 1
+    _local.generation = _conn_generation
+    conn = _local.conn = _open_conn()
+    with _stats_lock:
+        _stats['opened'] += 1
+        _live.add(conn)
     return conn
 
 
+def close_conn():
+    """Chiude la connessione del thread corrente, se aperta."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        with _stats_lock:
+            _live.discard(conn)
+    _local.conn = None
+
+
+def pool_stats():
+    """Statistiche delle connessioni del processo corrente."""
+    with _stats_lock:
+        return dict(_stats, live=len(_live), pid=os.getpid())
+
+
+# Connessioni del padre al momento del fork: nel figlio restano referenziate
+# per sempre, perché il GC le finalizzerebbe chiudendo l'handle SQLite condiviso
+# con il padre (chiusura attraverso un fork, che SQLite sconsiglia)
+_fork_held = []
+_inherited = []
+
+
+def _before_fork():
+    global _fork_held
+    with _stats_lock:
+        _fork_held = list(_live)
+
+
+def _after_fork_in_parent():
+    global _fork_held
+    _fork_held = []
+
+
+def _reset_after_fork():
+    # Le connessioni ereditate dal padre non vanno né usate né chiuse nel figlio:
+    # restano in _inherited e ogni thread ne riaprirà una al primo uso.
+    global _local, _live, _stats_lock, _nearby_index_lock, _fork_held
+    _inherited.extend(_fork_held)
+    _fork_held  = []
+    _local      = threading.local()
+    _live       = weakref.WeakSet()
+    _stats_lock = threading.Lock()
+    _nearby_index_lock = threading.Lock()
+    _stats.update(opened=0, reused=0, retired=0)
+    for cache in _caches.values():
+        cache._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork,
+                        after_in_parent=_after_fork_in_parent,
+                        after_in_child=_reset_after_fork)
+
+
+# ── Cache dei risultati ───────────────────────────────────────────
+# Cache LRU per funzione, con chiave sugli argomenti. I risultati cambiano
+# solo con un nuovo import o fix_regions --apply: quando il file del DB
+# cambia (inode, dimensione o mtime) tutte le cache vengono svuotate.
+# I valori restituiti sono condivisi tra le richieste: non vanno modificati.
+
+class _LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits    = 0
+        self.misses  = 0
+        self._data   = OrderedDict()
+        self._lock   = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data), 'maxsize': self.maxsize}
+
+
+_caches         = {}     # nome funzione → _LRUCache
+_db_token       = None
+_db_checked_at  = 0.0
+_invalidations  = 0
+
+
+def _db_file_token():
+    try:
+        st = os.stat(DB_PATH)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _check_db_changed():
+    """Svuota le cache se il file del DB è cambiato (al più ogni CACHE_CHECK_INTERVAL s)."""
+    global _db_token, _db_checked_at, _invalidations, _nearby_index, _conn_generation
+    now = time.monotonic()
+    if now - _db_checked_at < CACHE_CHECK_INTERVAL:
+        return
+    _db_checked_at = now
+    token = _db_file_token()
+    if token != _db_token:
+        if _db_token is not None:
+            # Prima le connessioni, poi le cache: un nuovo inode (file sostituito
+            # con os.replace) resterebbe invisibile alle connessioni già aperte
+            _conn_generation += 1
+            clear_caches()
+            _nearby_index = None
+            _invalidations += 1
+        _db_token = token
+
+
+def _cached(maxsize):
+    """Decoratore: memorizza i risultati di fn in una cache LRU di maxsize voci."""
+    def decorator(fn):
+        if not RESULT_CACHE:
+            return fn
+        cache = _caches[fn.__name__] = _LRUCache(maxsize)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            _check_db_changed()
+            key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+            found, value = cache.get(key)
+            if not found:
+                generation = _conn_generation
+                value = fn(*args, **kwargs)
+                # Un risultato letto dal file precedente non va in cache
+                if generation == _conn_generation:
+                    cache.put(key, value)
+            return value
+        return wrapper
+    return decorator
+
+
+def clear_caches():
+    for cache in _caches.values():
+        cache.clear()
+
+
+def data_version():
+    """Versione del file DB (inode, dimensione, mtime): uguale in tutti i worker."""
+    _check_db_changed()
+    return '%x-%x-%x' % _db_token if _db_token else '0'
+
+
+def data_mtime():
+    """Ultima modifica del file DB (epoch UTC), 0 se non disponibile."""
+    _check_db_changed()
+    return _db_token[2] / 1e9 if _db_token else 0.0
+
+
+def data_generation():
+    """Contatore delle modifiche rilevate al file DB (per invalidare cache esterne)."""
+    _check_db_changed()
+    return _invalidations
+
+
+def cache_stats():
+    """Hit/miss e occupazione di ogni cache, più il numero di invalidazioni."""
+    return {'functions':     {name: c.stats() for name, c in _caches.items()},
+            'invalidations': _invalidations}
+
+
 # ── Continenti ────────────────────────────────────────────────────
+# Conteggi letti dalle tabelle *_summary (vedi csv_to_sqlite.build_summary_tables)
 
+@_cached(maxsize=16)
 def get_continents():
     with get_conn() as conn:
         return conn.execute('''
-            SELECT continent,
-                   COUNT(*)                  AS city_count,
-                   COUNT(DISTINCT countrycode) AS country_count
-            FROM   cities
-            WHERE  continent != '' AND cityname != ''
-            GROUP  BY continent
+            SELECT continent, city_count, country_count
+            FROM   continent_summary
             ORDER  BY continent
         ''').fetchall()
 
 
 # ── Paesi ─────────────────────────────────────────────────────────
 
+@_cached(maxsize=16)
 def get_countries_by_continent(continent):
     with get_conn() as conn:
         return conn.execute('''
             SELECT countryname, countrycode, slug_country, continent,
-                   COUNT(*)                  AS city_count,
-                   COUNT(DISTINCT regionid)  AS region_count
-            FROM   cities
-            WHERE  continent = ? AND cityname != ''
-            GROUP  BY countrycode
+                   city_count, region_count
+            FROM   country_summary
+            WHERE  continent = ? AND city_count > 0
             ORDER  BY countryname
         ''', (continent,)).fetchall()
 
 
+@_cached(maxsize=1024)
 def get_country(country_slug):
     with get_conn() as conn:
         return conn.execute('''
             SELECT countryname, countrycode, continent, slug_country
-            FROM   cities
+            FROM   country_summary
             WHERE  slug_country = ?
             LIMIT  1
         ''', (country_slug,)).fetchone()
 
 
+@_cached(maxsize=1)
 def get_all_countries():
     with get_conn() as conn:
         return conn.execute('''
-            SELECT DISTINCT countryname, countrycode, slug_country, continent
-            FROM   cities
+            SELECT countryname, countrycode, slug_country, continent
+            FROM   country_summary
             WHERE  countryname != ''
             ORDER  BY countryname
         ''').fetchall()
@@ -62,50 +332,67 @@ def get_all_countries():
 
 # ── Regioni ───────────────────────────────────────────────────────
 
+@_cached(maxsize=1024)
 def get_regions_by_country(country_slug):
     with get_conn() as conn:
         return conn.execute('''
-            SELECT stateprovince, slug_region,
-                   COUNT(*) AS city_count
-            FROM   cities
-            WHERE  slug_country = ? AND stateprovince != '' AND cityname != ''
-            GROUP  BY slug_region
+            SELECT stateprovince, slug_region, city_count
+            FROM   region_summary
+            WHERE  slug_country = ? AND stateprovince != '' AND city_count > 0
             ORDER  BY stateprovince
         ''', (country_slug,)).fetchall()
 
 
+@_cached(maxsize=8192)
 def get_region(country_slug, region_slug):
     with get_conn() as conn:
         return conn.execute('''
             SELECT stateprovince, slug_region, countryname, slug_country, continent
-            FROM   cities
+            FROM   region_summary
             WHERE  slug_country = ? AND slug_region = ?
-            LIMIT  1
         ''', (country_slug, region_slug)).fetchone()
 
 
 # ── Città ─────────────────────────────────────────────────────────
 
-def get_cities_by_region(country_slug, region_slug, page=1, per_page=50):
-    offset = (page - 1) * per_page
+@_cached(maxsize=8192)
+def get_cities_by_region(country_slug, region_slug, page=1, per_page=50,
+                         after=None, before=None):
+    """Città di una regione in ordine (cityname, cityid) e totale (da region_summary).
+    after/before: cursore (cityname, cityid) della riga adiacente per la
+    paginazione keyset; senza cursore si usa OFFSET calcolato da page."""
+    params = [country_slug, region_slug]
+    if after:
+        keyset, order = 'AND (cityname, cityid) > (?, ?)', 'ASC'
+        params += after
+    elif before:
+        keyset, order = 'AND (cityname, cityid) < (?, ?)', 'DESC'
+        params += before
+    else:
+        keyset, order = '', 'ASC'
+    offset = 0 if (after or before) else (page - 1) * per_page
+
     with get_conn() as conn:
-        cities = conn.execute('''
+        cities = conn.execute(f'''
             SELECT cityid, cityname, slug_city, latitude, longitude
             FROM   cities
             WHERE  slug_country = ? AND slug_region = ? AND cityname != ''
-            ORDER  BY cityname
+              {keyset}
+            ORDER  BY cityname {order}, cityid {order}
             LIMIT  ? OFFSET ?
-        ''', (country_slug, region_slug, per_page, offset)).fetchall()
+        ''', params + [per_page, offset]).fetchall()
 
-        total = conn.execute('''
-            SELECT COUNT(*)
-            FROM   cities
-            WHERE  slug_country = ? AND slug_region = ? AND cityname != ''
-        ''', (country_slug, region_slug)).fetchone()[0]
+        row = conn.execute(
+            "SELECT city_count FROM region_summary WHERE slug_country = ? AND slug_region = ?",
+            (country_slug, region_slug)
+        ).fetchone()
 
-    return cities, total
+    if before:
+        cities.reverse()
+    return cities, (row[0] if row else 0)
 
 
+@_cached(maxsize=16384)
 def get_city(country_slug, region_slug, city_slug):
     with get_conn() as conn:
         return conn.execute('''
@@ -119,57 +406,186 @@ def get_city(country_slug, region_slug, city_slug):
 
 
 def get_nearby_cities(lat, lon, current_cityid, limit=12, radius_deg=2.0):
-    """Città vicine usando bounding box + distanza euclidea approssimata."""
+    """Città vicine: bounding box sull'indice R*Tree + distanza euclidea approssimata.
+    Con CITIES_NEARBY_INDEX=memory: k-NN esatto su grande cerchio (radius_deg ignorato)."""
     with get_conn() as conn:
-        return conn.execute('''
-            SELECT cityid, cityname, stateprovince, countryname,
-                   slug_city, slug_country, slug_region,
-                   latitude, longitude,
-                   ((latitude  - ?) * (latitude  - ?) +
-                    (longitude - ?) * (longitude - ?)) AS dist_sq
-            FROM   cities
-            WHERE  latitude  BETWEEN ? AND ?
-              AND  longitude BETWEEN ? AND ?
-              AND  cityname  != ''
-              AND  latitude  IS NOT NULL
-              AND  longitude IS NOT NULL
-              AND  cityid    != ?
-            ORDER  BY dist_sq
-            LIMIT  ?
-        ''', (
-            lat, lat, lon, lon,
-            lat - radius_deg, lat + radius_deg,
-            lon - radius_deg, lon + radius_deg,
-            current_cityid,
-            limit
-        )).fetchall()
+        return _nearby_cities(conn, lat, lon, current_cityid, limit, radius_deg)
+
+
+def _nearby_cities(conn, lat, lon, current_cityid, limit=12, radius_deg=2.0):
+    if NEARBY_INDEX == 'memory':
+        return _nearby_cities_memory(conn, lat, lon, current_cityid, limit)
+    return conn.execute('''
+        SELECT c.cityid, c.cityname, c.stateprovince, c.countryname,
+               c.slug_city, c.slug_country, c.slug_region,
+               c.latitude, c.longitude,
+               ((c.latitude  - ?) * (c.latitude  - ?) +
+                (c.longitude - ?) * (c.longitude - ?)) AS dist_sq
+        FROM   cities_rtree r
+        JOIN   cities c ON c.id = r.id
+        WHERE  r.max_lat >= ? AND r.min_lat <= ?
+          AND  r.max_lon >= ? AND r.min_lon <= ?
+          AND  c.cityid  != ?
+        ORDER  BY dist_sq
+        LIMIT  ?
+    ''', (
+        lat, lat, lon, lon,
+        lat - radius_deg, lat + radius_deg,
+        lon - radius_deg, lon + radius_deg,
+        current_cityid,
+        limit
+    )).fetchall()
+
+
+_nearby_index      = None
+_nearby_index_lock = threading.Lock()
+
+
+def get_nearby_index():
+    """Indice k-NN in memoria (costruito alla prima chiamata, poi condiviso dai thread)."""
+    global _nearby_index
+    if _nearby_index is None:
+        with _nearby_index_lock:
+            if _nearby_index is None:
+                # Senza `with`: può essere chiamata dentro load_city_page, la cui
+                # transazione di lettura non va chiusa qui
+                _nearby_index = geoindex.CityIndex(get_conn().execute('''
+                    SELECT id, latitude, longitude
+                    FROM   cities
+                    WHERE  cityname != '' AND latitude IS NOT NULL AND longitude IS NOT NULL
+                '''))
+    return _nearby_index
+
+
+def _nearby_cities_memory(conn, lat, lon, current_cityid, limit):
+    # L'indice contiene solo id e coordinate: i dati anagrafici dei k
+    # risultati si leggono per chiave primaria in un'unica query
+    hits = get_nearby_index().nearest(lat, lon, limit + 1)
+    if not hits:
+        return []
+    ids = [pid for _, pid in hits]
+    rows = conn.execute(f'''
+        SELECT id, cityid, cityname, stateprovince, countryname,
+               slug_city, slug_country, slug_region,
+               latitude, longitude
+        FROM   cities
+        WHERE  id IN ({','.join('?' * len(ids))})
+    ''', ids).fetchall()
+    by_id = {r['id']: r for r in rows}
+    ordered = [by_id[i] for i in ids if i in by_id]
+    return [r for r in ordered if r['cityid'] != current_cityid][:limit]
+
+
+# Conteggi regione/paese come sottoquery sulle tabelle di riepilogo
+_CITY_COUNTS_COLUMNS = '''
+    , (SELECT city_count FROM region_summary
+       WHERE  slug_country = c.slug_country AND slug_region = c.slug_region) AS region_city_count
+    , (SELECT SUM(city_count) FROM country_summary
+       WHERE  slug_country = c.slug_country) AS country_city_count
+'''
+
+
+# Dati delle pagine città (riga, conteggi, vicine) per slug e parts; i tempi
+# sono misurati a ogni chiamata, fuori dal valore in cache
+_city_page_cache = _LRUCache(16384)
+if RESULT_CACHE:
+    _caches['load_city_page'] = _city_page_cache
+
+
+def load_city_page(country_slug, region_slug, city_slug, parts=('nearby', 'counts')):
+    """Dati di una pagina città in un'unica transazione di lettura.
+    parts: 'counts' (città nella regione e nel paese, nella stessa query della
+    riga città) e/o 'nearby' (città vicine). Restituisce None se la città non
+    esiste, altrimenti un dict con city, nearby, region_city_count,
+    country_city_count e timings (ms per fase e totale; con il risultato in
+    cache solo 'cache' e 'total')."""
+    t0 = time.perf_counter()
+    key = (country_slug, region_slug, city_slug, tuple(parts))
+    if RESULT_CACHE:
+        _check_db_changed()
+        found, page = _city_page_cache.get(key)
+        if found:
+            elapsed = (time.perf_counter() - t0) * 1000
+            if page is None:
+                return None
+            return dict(page, timings={'cache': elapsed, 'total': elapsed})
+
+    generation = _conn_generation
+    page, timings = _query_city_page(country_slug, region_slug, city_slug, parts, t0)
+    if RESULT_CACHE and generation == _conn_generation:
+        _city_page_cache.put(key, page)
+    return None if page is None else dict(page, timings=timings)
+
+
+def _query_city_page(country_slug, region_slug, city_slug, parts, t0):
+    counts = 'counts' in parts
+    conn = get_conn()
+    conn.execute('BEGIN')
+    try:
+        city = conn.execute(f'''
+            SELECT c.cityid, c.cityname, c.stateprovince, c.countryname, c.countrycode,
+                   c.continent, c.latitude, c.longitude,
+                   c.slug_city, c.slug_country, c.slug_region
+                   {_CITY_COUNTS_COLUMNS if counts else ''}
+            FROM   cities c
+            WHERE  c.slug_country = ? AND c.slug_region = ? AND c.slug_city = ?
+            LIMIT  1
+        ''', (country_slug, region_slug, city_slug)).fetchone()
+        t_city = time.perf_counter()
+        if city is None:
+            return None, None
+
+        nearby = []
+        if 'nearby' in parts and city['latitude'] and city['longitude']:
+            nearby = _nearby_cities(conn, city['latitude'], city['longitude'], city['cityid'])
+        t_nearby = time.perf_counter()
+    finally:
+        conn.commit()
+
+    page = {
+        'city':               city,
+        'nearby':             nearby,
+        'region_city_count':  (city['region_city_count'] or 0) if counts else None,
+        'country_city_count': (city['country_city_count'] or 0) if counts else None,
+    }
+    return page, {
+        'city':   (t_city - t0) * 1000,
+        'nearby': (t_nearby - t_city) * 1000,
+        'total':  (t_nearby - t0) * 1000,
+    }
 
 
 # ── Sitemap ───────────────────────────────────────────────────────
 
-SITEMAP_CHUNK = 50_000
+# Blocchi di SITEMAP_CHUNK URL per intervalli di cities.id, precalcolati in
+# sitemap_chunks (vedi csv_to_sqlite.build_sitemap_chunks): ogni file è una
+# singola scansione per intervallo, con contenuto stabile tra le richieste.
+
+@_cached(maxsize=1)
+def get_sitemap_chunk_count():
+    with get_conn() as conn:
+        return conn.execute('SELECT COUNT(*) FROM sitemap_chunks').fetchone()[0]
 
 
-def get_cities_for_sitemap(offset, limit=SITEMAP_CHUNK):
+def get_cities_for_sitemap(chunk):
+    """URL città del blocco chunk (1-based), oppure None se il blocco non esiste."""
     with get_conn() as conn:
+        bounds = conn.execute(
+            'SELECT min_id, max_id FROM sitemap_chunks WHERE chunk = ?', (chunk,)
+        ).fetchone()
+        if bounds is None:
+            return None
         return conn.execute('''
             SELECT slug_city, slug_country, slug_region
             FROM   cities
-            WHERE  cityname != '' AND slug_city != ''
+            WHERE  id BETWEEN ? AND ?
+              AND  cityname != '' AND slug_city != ''
               AND  slug_country != '' AND slug_region != ''
-            LIMIT  ? OFFSET ?
-        ''', (limit, offset)).fetchall()
-
-
-def get_total_cities_with_slug():
-    with get_conn() as conn:
-        return conn.execute('''
-            SELECT COUNT(*) FROM cities
-            WHERE cityname != '' AND slug_city != ''
-              AND slug_country != '' AND slug_region != ''
-        ''').fetchone()[0]
+            ORDER  BY id
+        ''', tuple(bounds)).fetchall()
 
 
+@_cached(maxsize=1)
 def get_city_count():
     with get_conn() as conn:
         return conn.execute(
@@ -177,33 +593,56 @@ def get_city_count():
         ).fetchone()[0]
 
 
+@_cached(maxsize=8192)
 def get_region_city_count(country_slug, region_slug):
     """Numero di città in una regione specifica."""
     with get_conn() as conn:
-        return conn.execute(
-            "SELECT COUNT(*) FROM cities WHERE slug_country = ? AND slug_region = ? AND cityname != ''",
+        row = conn.execute(
+            "SELECT city_count FROM region_summary WHERE slug_country = ? AND slug_region = ?",
             (country_slug, region_slug)
-        ).fetchone()[0]
+        ).fetchone()
+    return row[0] if row else 0
 
 
+@_cached(maxsize=1024)
 def get_country_city_count(country_slug):
     """Numero totale di città in un paese."""
     with get_conn() as conn:
         return conn.execute(
-            "SELECT COUNT(*) FROM cities WHERE slug_country = ? AND cityname != ''",
+            "SELECT COALESCE(SUM(city_count), 0) FROM country_summary WHERE slug_country = ?",
             (country_slug,)
         ).fetchone()[0]
 
 
+@_cached(maxsize=2048)
 def search_cities(query, limit=30):
-    """Ricerca città per nome (parziale, case-insensitive)."""
+    """Ricerca città per nome (parziale, case-insensitive).
+    Prima i nomi che iniziano con query (indice NOCASE), poi quelli che la
+    contengono (indice FTS5 trigram). Sotto i 3 caratteri il trigram non si
+    applica e una scansione LIKE costerebbe l'intera tabella: solo prefissi."""
     with get_conn() as conn:
-        return conn.execute('''
+        rows = conn.execute('''
             SELECT cityname, stateprovince, countryname, countrycode,
                    slug_city, slug_country, slug_region
             FROM   cities
-            WHERE  cityname LIKE ? AND cityname != ''
+            WHERE  cityname COLLATE NOCASE >= ? AND cityname COLLATE NOCASE < ?
+              AND  cityname != ''
               AND  slug_city != '' AND slug_country != '' AND slug_region != ''
-            ORDER  BY cityname
+            ORDER  BY cityname COLLATE NOCASE
             LIMIT  ?
-        ''', (f'%{query}%', limit)).fetchall()
+        ''', (query, query + '\U0010ffff', limit)).fetchall()
+
+        if len(rows) < limit and len(query) >= 3:
+            # Niente ORDER BY: la scansione si ferma ai primi risultati anche per
+            # sottostringhe comuni; si ordina in Python solo la pagina restituita
+            rows += sorted(conn.execute('''
+                SELECT c.cityname, c.stateprovince, c.countryname, c.countrycode,
+                       c.slug_city, c.slug_country, c.slug_region
+                FROM   cities_fts f JOIN cities c ON c.id = f.rowid
+                WHERE  f.cityname LIKE ?
+                  AND  c.cityname NOT LIKE ? AND c.cityname != ''
+                  AND  c.slug_city != '' AND c.slug_country != '' AND c.slug_region != ''
+                LIMIT  ?
+            ''', (f'%{query}%', f'{query}%', limit - len(rows))),
+                key=lambda r: r['cityname'])
+    return rows
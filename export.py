@@ -0,0 +1,231 @@
+"""
+export.py — Esportazione statica del sito in una directory.
+
+Uso: python app.py export OUTDIR [n_processi]
+
+Rende homepage, continenti, paesi, regioni (tutte le pagine), città con le
+sottopagine, sitemap e robots.txt, e scrive ogni risposta come file (.html,
+.xml, .txt) più la variante precompressa .gz, così nginx può servire il sito
+staticamente e l'app Python gestisce solo /search.
+
+Le pagine sono rese chiamando l'app WSGI in un pool di processi (fork, un
+DB aperto per processo). Ogni file è scritto in modo atomico e il suo ETag è
+registrato in OUTDIR/.export-manifest.tsv: a un nuovo avvio ogni pagina è
+richiesta con If-None-Match e un 304 la salta senza rendering. Un'esportazione
+interrotta riprende dal punto in cui si era fermata; una successiva riscrive
+solo le pagine cambiate (nuovi dati, nuovo codice o, per le pagine città,
+nuovo giorno UTC — conviene eseguirla subito dopo la mezzanotte UTC).
+
+Mappa URL → file:
+  /                               → index.html
+  /country/x/y/                   → country/x/y/index.html
+  /country/x/y/?page=N            → country/x/y/page-N.html
+  /sitemap.xml, /robots.txt, …    → stesso nome
+
+Esempio nginx (i parametri after/before della paginazione sono ignorati:
+la pagina N è la stessa con o senza cursore):
+
+  location / {
+      gzip_static on;
+      if ($arg_page ~ "^[0-9]+$") { rewrite ^(.*/)$ $1page-$arg_page.html break; }
+      try_files $uri $uri/index.html @app;
+  }
+  location /search { proxy_pass http://app; }
+"""
+
+import gzip
+import io
+import math
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import db
+
+MANIFEST   = '.export-manifest.tsv'
+PER_PAGE   = 50          # come la vista region()
+CHUNKSIZE  = 64          # URL per invio al processo worker
+
+CITY_SUBPAGES = ('', 'time/', 'sunrise/', 'moon/', 'golden-hour/', 'daylight/', 'nearby/')
+
+_wsgi_app = None         # impostata da export() prima del fork
+_outdir   = None
+
+
+# ── URL da esportare ──────────────────────────────────────────────
+
+def _continent_slug(name):
+    # Stesso slug dei link in index.tpl
+    return re.sub(r'[-\s]+', '-', name.lower().strip())
+
+
+def iter_urls():
+    """Tutti gli URL (path, query) linkati dal sito, /search escluso."""
+    yield '/', ''
+    yield '/robots.txt', ''
+    yield '/sitemap.xml', ''
+    yield '/sitemap-countries.xml', ''
+    for n in range(1, db.get_sitemap_chunk_count() + 1):
+        yield f'/sitemap-cities-{n}.xml', ''
+
+    for c in db.get_continents():
+        yield '/continent/' + _continent_slug(c['continent']) + '/', ''
+
+    for c in db.get_all_countries():
+        cslug = c['slug_country']
+        if not cslug:
+            continue
+        yield f'/country/{cslug}/', ''
+        for r in db.get_regions_by_country(cslug):
+            base = f'/country/{cslug}/{r["slug_region"]}/'
+            yield base, ''
+            for page in range(2, math.ceil(r['city_count'] / PER_PAGE) + 1):
+                yield base, f'page={page}'
+
+    for n in range(1, db.get_sitemap_chunk_count() + 1):
+        for c in db.get_cities_for_sitemap(n):
+            base = f'/country/{c["slug_country"]}/{c["slug_region"]}/{c["slug_city"]}/'
+            for sub in CITY_SUBPAGES:
+                yield base + sub, ''
+
+
+def url_to_file(path, query=''):
+    """Percorso relativo del file che contiene la risposta per path?query."""
+    rel = path.lstrip('/')
+    if query.startswith('page='):
+        return rel + f'page-{query[5:]}.html'
+    if not rel or rel.endswith('/'):
+        return rel + 'index.html'
+    return rel
+
+
+# ── Rendering (nei processi worker) ───────────────────────────────
+
+def _write_atomic(path, data):
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _render(job):
+    """Rende un URL; restituisce (url, etag, esito) con esito 'written', 'skipped' o lo status."""
+    path, query, etag = job
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_NAME': 'export', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'https', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+    }
+    if etag:
+        environ['HTTP_IF_NONE_MATCH'] = etag
+
+    captured = []
+
+    def start_response(status, headers, exc_info=None):
+        captured[:] = [status, headers]
+
+    result = _wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    status, headers = captured
+    url = path + ('?' + query if query else '')
+    if status.startswith('304'):
+        return url, etag, 'skipped'
+    if not status.startswith('200'):
+        return url, None, status
+
+    target = os.path.join(_outdir, url_to_file(path, query))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    _write_atomic(target, body)
+    # mtime=0: stesso .gz a parità di contenuto
+    _write_atomic(target + '.gz', gzip.compress(body, compresslevel=9, mtime=0))
+    new_etag = next((v for k, v in headers if k.lower() == 'etag'), None)
+    return url, new_etag, 'written'
+
+
+# ── Manifest ──────────────────────────────────────────────────────
+
+def _load_manifest(outdir):
+    """url → ETag delle pagine già esportate (l'ultima riga vince)."""
+    etags = {}
+    try:
+        with open(os.path.join(outdir, MANIFEST), encoding='utf-8') as f:
+            for line in f:
+                url, _, etag = line.rstrip('\n').partition('\t')
+                if etag:
+                    etags[url] = etag
+    except FileNotFoundError:
+        pass
+    return etags
+
+
+def _save_manifest(outdir, etags):
+    path = os.path.join(outdir, MANIFEST)
+    data = ''.join(f'{url}\t{etag}\n' for url, etag in sorted(etags.items()))
+    _write_atomic(path, data.encode('utf-8'))
+
+
+# ── Esportazione ──────────────────────────────────────────────────
+
+def export(wsgi_app, outdir, processes=None):
+    """Esporta il sito in outdir; restituisce i contatori per esito."""
+    global _wsgi_app, _outdir
+    _wsgi_app, _outdir = wsgi_app, os.path.abspath(outdir)
+    os.makedirs(_outdir, exist_ok=True)
+    processes = processes or os.cpu_count() or 1
+
+    etags = _load_manifest(_outdir)
+    jobs, seen = [], set()
+    for path, query in iter_urls():
+        url = path + ('?' + query if query else '')
+        if url in seen:          # città omonime con lo stesso slug
+            continue
+        seen.add(url)
+        etag = etags.get(url)
+        # Un file cancellato va riscritto anche se il manifest lo conosce
+        if etag and not os.path.exists(os.path.join(_outdir, url_to_file(path, query))):
+            etag = None
+        jobs.append((path, query, etag))
+    print(f'Esportazione in {_outdir}: {len(jobs):,} URL, {processes} processi')
+
+    # Le connessioni del padre non vanno condivise con i figli
+    db.close_conn()
+    counts = {'written': 0, 'skipped': 0, 'errors': 0}
+    start = time.time()
+    with open(os.path.join(_outdir, MANIFEST), 'a', encoding='utf-8') as log, \
+            multiprocessing.get_context('fork').Pool(processes) as pool:
+        for i, (url, etag, outcome) in enumerate(
+                pool.imap_unordered(_render, jobs, chunksize=CHUNKSIZE), 1):
+            if outcome == 'written':
+                counts['written'] += 1
+                if etag:
+                    etags[url] = etag
+                    log.write(f'{url}\t{etag}\n')
+            elif outcome == 'skipped':
+                counts['skipped'] += 1
+            else:
+                counts['errors'] += 1
+                print(f'\n  {url}: {outcome}')
+            if i % 1000 == 0:
+                log.flush()
+                elapsed = time.time() - start
+                print(f'  {i:>10,} / {len(jobs):,}  ({i / elapsed:,.0f} URL/s)', end='\r')
+
+    _save_manifest(_outdir, etags)
+    elapsed = time.time() - start
+    print(f'\nCompletata in {elapsed:.1f}s: {counts["written"]:,} scritte, '
+          f'{counts["skipped"]:,} invariate, {counts["errors"]:,} errori')
+    return counts
+
+
+def main(wsgi_app, argv):
+    if not argv:
+        print('Uso: python app.py export OUTDIR [n_processi]')
+        sys.exit(1)
+    counts = export(wsgi_app, argv[0], int(argv[1]) if len(argv) > 1 else None)
+    sys.exit(1 if counts['errors'] else 0)
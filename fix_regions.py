@@ -15,6 +15,9 @@ ALGORITMO in 4 fasi:
   4. DUPLICATI POST-UPDATE: simula gli UPDATE in memoria, poi trova coppie
                      con stesso (cityname, countrycode, regionid) entro 50 km
                      → DELETE il record con cityid maggiore
+
+Con --apply, a modifiche completate vengono ricostruite le tabelle derivate
+e i file sitemap (vedi csv_to_sqlite.build_derived_tables).
 """
 
 import math
@@ -24,6 +27,8 @@ import sqlite3
 import sys
 from collections import defaultdict
 
+from csv_to_sqlite import build_derived_tables
+
 DB_PATH  = os.environ.get('CITIES_DB', 'cities.db')
 DRY_RUN  = '--apply' not in sys.argv
 
@@ -385,6 +390,9 @@ def apply_changes(conn, dup_ids, updates, post_ids):
     total = cur.execute("SELECT COUNT(*) FROM cities").fetchone()[0]
     print(f"\nRighe totali dopo pulizia: {total:,}")
 
+    # Riepiloghi e indici derivati allineati ai dati corretti
+    build_derived_tables(conn)
+
 
 # ── MAIN ──────────────────────────────────────────────────────────────────────
 
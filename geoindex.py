@@ -0,0 +1,119 @@
+"""
+geoindex.py — Indice spaziale in memoria per la ricerca delle città vicine.
+
+Griglia lat/lon a celle fisse (CELL_DEG gradi) memorizzata in array compatti:
+i punti sono ordinati per cella (counting sort) e ogni cella è un intervallo
+contiguo degli array. La ricerca dei k vicini raddoppia un raggio (km) finché
+la calotta sferica di quel raggio contiene almeno k punti; le celle da
+esaminare sono calcolate sulla sfera, quindi antimeridiano e poli sono gestiti
+correttamente e le distanze sono di grande cerchio (Haversine).
+
+Memoria: 24 byte per città (lat, lon, id) + 8 byte per cella.
+"""
+
+import math
+from array import array
+
+R_KM     = 6371.0
+CELL_DEG = 0.25
+
+_NCOLS = int(round(360 / CELL_DEG))
+_NROWS = int(round(180 / CELL_DEG))
+
+
+def _cell_row(lat):
+    return min(_NROWS - 1, max(0, int((lat + 90) / CELL_DEG)))
+
+
+def _cell_col(lon):
+    return int(math.floor((lon + 180) / CELL_DEG)) % _NCOLS
+
+
+class CityIndex:
+    """Indice k-NN su grande cerchio. points: iterabile di (id, lat, lon)."""
+
+    def __init__(self, points):
+        ids, lats, lons, cells = array('q'), array('d'), array('d'), array('l')
+        for pid, lat, lon in points:
+            ids.append(pid)
+            lats.append(lat)
+            lons.append(lon)
+            cells.append(_cell_row(lat) * _NCOLS + _cell_col(lon))
+
+        # Counting sort per cella: start[c]..start[c+1] sono i punti della cella c
+        start = array('l', bytes(array('l').itemsize * (_NROWS * _NCOLS + 1)))
+        for c in cells:
+            start[c + 1] += 1
+        for c in range(1, len(start)):
+            start[c] += start[c - 1]
+
+        n = len(ids)
+        pos = array('l', start[:-1])
+        self._id  = array('q', bytes(8 * n))
+        self._lat = array('d', bytes(8 * n))
+        self._lon = array('d', bytes(8 * n))
+        for i in range(n):
+            c = cells[i]
+            j = pos[c]
+            pos[c] = j + 1
+            self._id[j], self._lat[j], self._lon[j] = ids[i], lats[i], lons[i]
+        self._start = start
+
+    def __len__(self):
+        return len(self._id)
+
+    def nbytes(self):
+        """Memoria occupata dagli array dell'indice (byte)."""
+        return sum(a.itemsize * len(a) for a in (self._id, self._lat, self._lon, self._start))
+
+    def _cell_ranges(self, lat, lon, radius_km):
+        """Intervalli [a, b) degli array che coprono la calotta di raggio radius_km."""
+        r_deg = math.degrees(radius_km / R_KM)
+        lat_lo, lat_hi = lat - r_deg, lat + r_deg
+
+        if lat_lo <= -90 or lat_hi >= 90:
+            col_spans = [(0, _NCOLS - 1)]     # la calotta contiene un polo
+        else:
+            dlon = math.degrees(math.asin(
+                min(1.0, math.sin(radius_km / R_KM) / math.cos(math.radians(lat)))))
+            if 2 * dlon >= 360 - CELL_DEG:
+                col_spans = [(0, _NCOLS - 1)]
+            else:
+                c0, c1 = _cell_col(lon - dlon), _cell_col(lon + dlon)
+                col_spans = [(c0, c1)] if c0 <= c1 else [(c0, _NCOLS - 1), (0, c1)]
+
+        start = self._start
+        for row in range(_cell_row(lat_lo), _cell_row(lat_hi) + 1):
+            base = row * _NCOLS
+            for c0, c1 in col_spans:
+                a, b = start[base + c0], start[base + c1 + 1]
+                if a < b:
+                    yield a, b
+
+    def nearest(self, lat, lon, k):
+        """Restituisce [(distanza_km, id), …] dei k punti più vicini, in ordine."""
+        if not self._id or k <= 0:
+            return []
+        ids, lats, lons = self._id, self._lat, self._lon
+        sin, cos, asin, sqrt, radians = math.sin, math.cos, math.asin, math.sqrt, math.radians
+        phi1 = radians(lat)
+        cos_phi1 = cos(phi1)
+
+        # Raggio iniziale: metà di quello che, a densità uniforme, conterrebbe k punti
+        radius = R_KM * math.sqrt(k / len(ids))
+        while True:
+            # a (termine di Haversine) è monotono con la distanza: niente asin
+            # per i punti fuori dal raggio
+            a_max = sin(radius / (2 * R_KM)) ** 2
+            found = []
+            for a_i, b_i in self._cell_ranges(lat, lon, radius):
+                for i in range(a_i, b_i):
+                    phi2 = radians(lats[i])
+                    a = (sin((phi2 - phi1) / 2) ** 2
+                         + cos_phi1 * cos(phi2) * sin(radians(lons[i] - lon) / 2) ** 2)
+                    if a <= a_max:
+                        found.append((a, ids[i]))
+            if len(found) >= k or radius >= math.pi * R_KM:
+                found.sort()
+                return [(2 * R_KM * asin(sqrt(min(1.0, a))), pid) for a, pid in found[:k]]
+            radius *= 2
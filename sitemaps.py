@@ -0,0 +1,169 @@
+"""
+sitemaps.py — File sitemap precostruiti.
+
+Scrive in SITEMAP_DIR l'indice sitemap.xml, sitemap-countries.xml e un file
+sitemap-cities-N.xml per ogni blocco di sitemap_chunks, ciascuno con la
+variante .xml.gz. app.py serve questi file se presenti, altrimenti rende le
+sitemap dal DB a ogni richiesta.
+
+Ogni file è scritto in modo atomico (file temporaneo + rename) e l'indice per
+ultimo, quindi non punta mai a file mancanti. <lastmod> è la data UTC
+dell'ultima build in cui l'elenco di URL del file è cambiato (hash in
+SITEMAP_DIR/manifest.tsv): un import che non tocca un blocco non ne cambia la
+data né il file.
+
+BASE_URL deve essere lo stesso dell'app (stessa variabile d'ambiente): è
+registrato nel manifest, e app.py non serve i file costruiti per un altro
+BASE_URL (li rende dal DB e lo segnala su stderr).
+"""
+
+import gzip
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+SITEMAP_DIR = os.environ.get('SITEMAP_DIR', 'sitemaps')
+BASE_URL    = os.environ.get('BASE_URL', 'https://example.com').rstrip('/')
+MANIFEST    = 'manifest.tsv'
+
+
+# ── URL per file ──────────────────────────────────────────────────
+
+def _country_urls(conn, base_url):
+    yield f'{base_url}/', '1.0'
+    for (slug,) in conn.execute('''
+        SELECT slug_country
+        FROM   country_summary
+        WHERE  countryname != ''
+        ORDER  BY countryname
+    '''):
+        yield f'{base_url}/country/{slug}/', '0.8'
+
+
+def _city_urls(conn, base_url, min_id, max_id):
+    for c, r, s in conn.execute('''
+        SELECT slug_country, slug_region, slug_city
+        FROM   cities
+        WHERE  id BETWEEN ? AND ?
+          AND  cityname != '' AND slug_city != ''
+          AND  slug_country != '' AND slug_region != ''
+        ORDER  BY id
+    ''', (min_id, max_id)):
+        yield f'{base_url}/country/{c}/{r}/{s}/', '0.6'
+
+
+def _iter_files(conn, base_url):
+    """(nome file, [(loc, priority), …]) per ogni sitemap, uno alla volta."""
+    yield 'sitemap-countries.xml', list(_country_urls(conn, base_url))
+    chunks = conn.execute(
+        'SELECT chunk, min_id, max_id FROM sitemap_chunks ORDER BY chunk').fetchall()
+    for chunk, lo, hi in chunks:
+        yield f'sitemap-cities-{chunk}.xml', list(_city_urls(conn, base_url, lo, hi))
+
+
+# ── XML ───────────────────────────────────────────────────────────
+
+def _urlset(urls, lastmod):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    for loc, priority in urls:
+        parts.append(f'  <url>\n'
+                     f'    <loc>{escape(loc)}</loc>\n'
+                     f'    <lastmod>{lastmod}</lastmod>\n'
+                     f'    <priority>{priority}</priority>\n'
+                     f'  </url>\n')
+    parts.append('</urlset>\n')
+    return ''.join(parts)
+
+
+def _sitemap_index(base_url, files):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    for name, (_, lastmod) in files.items():
+        parts.append(f'  <sitemap>\n'
+                     f'    <loc>{escape(base_url)}/{name}</loc>\n'
+                     f'    <lastmod>{lastmod}</lastmod>\n'
+                     f'  </sitemap>\n')
+    parts.append('</sitemapindex>\n')
+    return ''.join(parts)
+
+
+# ── Scrittura ─────────────────────────────────────────────────────
+
+def _write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _write_sitemap(outdir, name, text):
+    """Scrive name e name.gz; False se il contenuto su disco è già identico."""
+    path = os.path.join(outdir, name)
+    data = text.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data and os.path.exists(path + '.gz'):
+                return False
+    except FileNotFoundError:
+        pass
+    # .gz prima del file non compresso: chi vede il nuovo .xml trova anche il .gz
+    _write_atomic(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    _write_atomic(path, data)
+    return True
+
+
+def _load_manifest(outdir):
+    """(BASE_URL, {nome file → (hash degli URL, lastmod)}) della build precedente."""
+    base_url, files = None, {}
+    try:
+        with open(os.path.join(outdir, MANIFEST), encoding='utf-8') as f:
+            for line in f:
+                name, digest, lastmod = line.rstrip('\n').split('\t')
+                if name == '#base_url':
+                    base_url = digest
+                else:
+                    files[name] = (digest, lastmod)
+    except FileNotFoundError:
+        pass
+    return base_url, files
+
+
+def built_base_url(outdir=SITEMAP_DIR):
+    """BASE_URL con cui sono stati costruiti i file in outdir (None se ignoto)."""
+    return _load_manifest(outdir)[0]
+
+
+def build_sitemaps(conn, outdir=SITEMAP_DIR, base_url=BASE_URL):
+    """Ricostruisce i file sitemap in outdir; restituisce il numero di file scritti."""
+    start = time.time()
+    os.makedirs(outdir, exist_ok=True)
+    _, old = _load_manifest(outdir)
+    today = datetime.now(timezone.utc).date().isoformat()
+    files = {}
+    written = 0
+
+    for name, urls in _iter_files(conn, base_url):
+        digest = hashlib.sha1('\n'.join(loc for loc, _ in urls).encode('utf-8')).hexdigest()
+        prev = old.get(name)
+        if prev and prev[0] == digest and os.path.exists(os.path.join(outdir, name)):
+            files[name] = prev
+            continue
+        files[name] = (digest, today)
+        written += _write_sitemap(outdir, name, _urlset(urls, today))
+
+    written += _write_sitemap(outdir, 'sitemap.xml', _sitemap_index(base_url, files))
+    _write_atomic(os.path.join(outdir, MANIFEST), (f'#base_url\t{base_url}\t\n' + ''.join(
+        f'{name}\t{digest}\t{lastmod}\n'
+        for name, (digest, lastmod) in files.items())).encode('utf-8'))
+
+    # Blocchi non più esistenti (dopo l'indice, che non li elenca più)
+    for name in old.keys() - files.keys():
+        for path in (os.path.join(outdir, name), os.path.join(outdir, name + '.gz')):
+            if os.path.exists(path):
+                os.remove(path)
+
+    print(f'Sitemap: {written} file scritti in {outdir} in {time.time() - start:.1f}s')
+    return written
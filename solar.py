@@ -0,0 +1,210 @@
+"""
+solar.py — Calcoli solari (alba, tramonto, attraversamenti di elevazione).
+
+Stesse formule di sempre (declinazione e equazione del tempo approssimate,
+precisione di qualche minuto), su più giorni e/o più coordinate in una
+chiamata. Declinazione ed equazione del tempo dipendono solo dal giorno
+dell'anno: sono in tabelle di 366 voci calcolate all'import, e per ogni
+coordinata resta solo l'angolo orario. Due motori:
+  - 'numpy'  : vettoriale, se NumPy è installato
+  - 'python' : ciclo scalare, sempre disponibile
+
+SOLAR_ENGINE=auto (default) usa NumPy se c'è; 'python' o 'numpy' lo impongono.
+I due motori danno gli stessi risultati a meno di errori di arrotondamento
+(< 1e-9 h); `python bench.py solar` lo verifica.
+
+Argomenti lat, lon, days (giorni dell'anno interi, 1–366): scalari o sequenze
+della stessa lunghezza (con NumPy anche array broadcastabili). Con almeno una
+sequenza i risultati sono liste, altrimenti scalari. Gli orari sono ore UTC decimali in [0, 24).
+"""
+
+import math
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SOLAR_ENGINE = os.environ.get('SOLAR_ENGINE', 'auto').lower()
+USE_NUMPY = np is not None and SOLAR_ENGINE in ('auto', 'numpy')
+if SOLAR_ENGINE == 'numpy' and np is None:
+    raise ImportError('SOLAR_ENGINE=numpy ma NumPy non è installato')
+
+# Esito di sun_times
+OK, MIDNIGHT_SUN, POLAR_NIGHT, NA = 0, 1, 2, 3
+
+# Alba/tramonto: centro del sole a 90.833° dallo zenit (rifrazione + raggio)
+SIN_SUNRISE = math.cos(math.radians(90.833))
+
+# Soglie di elevazione del sole (gradi) per crepuscoli, blue hour e golden hour
+ASTRONOMICAL = -18.0
+NAUTICAL     = -12.0
+CIVIL        = -6.0
+BLUE_END     = -4.0
+HORIZON      = -0.833
+GOLDEN_END   = 6.0
+
+
+# ── Tabelle per giorno dell'anno ──────────────────────────────────
+# Indice = N (l'indice 0 non è usato): seno e coseno della declinazione,
+# equazione del tempo in minuti.
+
+def _day_terms(N):
+    decl = 23.45 * math.sin(math.radians(360 / 365 * (N - 81)))
+    B = math.radians(360 / 365 * (N - 81))
+    EoT = 9.87 * math.sin(2 * B) - 7.53 * math.cos(B) - 1.5 * math.sin(B)
+    return math.sin(math.radians(decl)), math.cos(math.radians(decl)), EoT
+
+
+SIN_DECL, COS_DECL, EOT = (list(t) for t in zip(*(_day_terms(N) for N in range(367))))
+
+if np is not None:
+    _NP_SIN_DECL, _NP_COS_DECL, _NP_EOT = (np.array(t) for t in (SIN_DECL, COS_DECL, EOT))
+
+
+def _is_seq(x):
+    return isinstance(x, (list, tuple, range)) or (np is not None and isinstance(x, np.ndarray))
+
+
+# ── Motore Python ─────────────────────────────────────────────────
+
+def _py_terms(lat, lon, N, sin_h0):
+    """(cos_H, denominatore, mezzogiorno solare UTC) per un giorno e una coordinata."""
+    cos_H_num = sin_h0 - math.sin(math.radians(lat)) * SIN_DECL[N]
+    cos_H_den = math.cos(math.radians(lat)) * COS_DECL[N]
+    solar_noon = 12 - lon / 15 - EOT[N] / 60
+    if cos_H_den == 0:
+        return None, 0, solar_noon
+    return cos_H_num / cos_H_den, cos_H_den, solar_noon
+
+
+def _py_sun_time(lat, lon, N, sin_h0):
+    cos_H, den, solar_noon = _py_terms(lat, lon, N, sin_h0)
+    if den == 0:
+        return None, None, None, NA
+    if cos_H < -1:
+        return None, None, None, MIDNIGHT_SUN
+    if cos_H > 1:
+        return None, None, None, POLAR_NIGHT
+    H_hours = math.degrees(math.acos(cos_H)) / 15
+    return (solar_noon - H_hours) % 24, (solar_noon + H_hours) % 24, 2 * H_hours, OK
+
+
+def _py_crossing(lat, lon, N, sin_h0):
+    cos_H, den, solar_noon = _py_terms(lat, lon, N, sin_h0)
+    if den == 0 or abs(cos_H) > 1:
+        return None, None
+    H_hours = math.degrees(math.acos(cos_H)) / 15
+    return (solar_noon - H_hours) % 24, (solar_noon + H_hours) % 24
+
+
+def _py_crossings_one(lat, lon, N, sin_h0s):
+    """Tutte le soglie per una coordinata e un giorno: i termini che non
+    dipendono dall'elevazione sono calcolati una volta sola."""
+    sin_lat_decl = math.sin(math.radians(lat)) * SIN_DECL[N]
+    cos_H_den = math.cos(math.radians(lat)) * COS_DECL[N]
+    solar_noon = 12 - lon / 15 - EOT[N] / 60
+    if cos_H_den == 0:
+        return [(None, None)] * len(sin_h0s)
+    out = []
+    for sin_h0 in sin_h0s:
+        cos_H = (sin_h0 - sin_lat_decl) / cos_H_den
+        if abs(cos_H) > 1:
+            out.append((None, None))
+            continue
+        H_hours = math.degrees(math.acos(cos_H)) / 15
+        out.append(((solar_noon - H_hours) % 24, (solar_noon + H_hours) % 24))
+    return out
+
+
+def _py_map(fn, lat, lon, days, sin_h0):
+    args = [lat, lon, days, sin_h0]
+    n = next((len(a) for a in args if _is_seq(a)), None)
+    if n is None:
+        return fn(lat, lon, days, sin_h0)
+    cols = [a if _is_seq(a) else [a] * n for a in args]
+    return [fn(*row) for row in zip(*cols)]
+
+
+def _transpose(rows, width):
+    if isinstance(rows, tuple):
+        return rows
+    return tuple([r[i] for r in rows] for i in range(width))
+
+
+# ── Motore NumPy ──────────────────────────────────────────────────
+
+def _np_terms(lat, lon, days, sin_h0):
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    N, sin_h0 = np.asarray(days, dtype=np.intp), np.asarray(sin_h0, dtype=float)
+    num = sin_h0 - np.sin(np.radians(lat)) * _NP_SIN_DECL[N]
+    den = np.cos(np.radians(lat)) * _NP_COS_DECL[N]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_H = num / den
+    solar_noon = 12 - lon / 15 - _NP_EOT[N] / 60
+    H_hours = np.degrees(np.arccos(np.clip(cos_H, -1, 1))) / 15
+    return cos_H, den, solar_noon, H_hours
+
+
+def _np_out(values, valid):
+    """Array → lista (o scalare) di float Python, None dove non valido."""
+    return np.where(valid, values.astype(object), None).tolist()
+
+
+def _np_sun_times(lat, lon, days, sin_h0):
+    cos_H, den, solar_noon, H_hours = _np_terms(lat, lon, days, sin_h0)
+    status = np.select([den == 0, cos_H < -1, cos_H > 1],
+                       [NA, MIDNIGHT_SUN, POLAR_NIGHT], OK)
+    valid = status == OK
+    return (_np_out((solar_noon - H_hours) % 24, valid),
+            _np_out((solar_noon + H_hours) % 24, valid),
+            _np_out(2 * H_hours, valid),
+            status.tolist())
+
+
+def _np_crossings(lat, lon, days, sin_h0):
+    cos_H, den, solar_noon, H_hours = _np_terms(lat, lon, days, sin_h0)
+    valid = (den != 0) & (np.abs(cos_H) <= 1)
+    return (_np_out((solar_noon - H_hours) % 24, valid),
+            _np_out((solar_noon + H_hours) % 24, valid))
+
+
+# ── API ───────────────────────────────────────────────────────────
+
+def sun_times(lat, lon, days, engine=None):
+    """Alba, tramonto e durata del giorno per i giorni dell'anno days (1–366).
+    Restituisce (rise, set, length, status): orari None se status != OK
+    (MIDNIGHT_SUN, POLAR_NIGHT, NA)."""
+    if engine == 'numpy' or (engine is None and USE_NUMPY):
+        return _np_sun_times(lat, lon, days, SIN_SUNRISE)
+    return _transpose(_py_map(_py_sun_time, lat, lon, days, SIN_SUNRISE), 4)
+
+
+_SIN_ELEV = {}      # elevazione → seno (le soglie usate sono poche e fisse)
+
+
+def _sin_elev(elev_deg):
+    value = _SIN_ELEV.get(elev_deg)
+    if value is None:
+        value = _SIN_ELEV[elev_deg] = math.sin(math.radians(elev_deg))
+    return value
+
+
+def elevation_crossings(lat, lon, day, elevations):
+    """Attraversamenti di più soglie di elevazione per una sola coordinata e un
+    solo giorno, in una passata: lista di (mattino, sera) in ore UTC, nello
+    stesso ordine di elevations, None dove il sole non raggiunge la soglia.
+    Sempre in Python: per pochi valori NumPy costerebbe più del calcolo."""
+    return _py_crossings_one(lat, lon, day, [_sin_elev(e) for e in elevations])
+
+
+def elevation_times(lat, lon, days, elev_deg, engine=None):
+    """Ore UTC (mattino, sera) in cui il sole attraversa elev_deg gradi di
+    elevazione; None se quel giorno non la raggiunge. elev_deg può essere una
+    sequenza (es. più soglie per lo stesso giorno e la stessa coordinata)."""
+    sin_h0 = ([math.sin(math.radians(e)) for e in elev_deg] if _is_seq(elev_deg)
+              else math.sin(math.radians(elev_deg)))
+    if engine == 'numpy' or (engine is None and USE_NUMPY):
+        return _np_crossings(lat, lon, days, sin_h0)
+    return _transpose(_py_map(_py_crossing, lat, lon, days, sin_h0), 2)
@@ -0,0 +1,213 @@
+"""
+Richieste condizionali (ETag / Last-Modified → 304) sull'app completa
+(app.application: gzip, cache delle pagine, viste) con un DB minimo.
+
+Uso: python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CITIES = [
+    # cityid, regionid, countryid, countryname, countrycode, continent,
+    # stateprovince, cityname, latitude, longitude
+    ('1', 'r1', 'c1', 'Italy', 'IT', 'Europe', 'Lombardy', 'Milan',   45.46, 9.19),
+    ('2', 'r1', 'c1', 'Italy', 'IT', 'Europe', 'Lombardy', 'Bergamo', 45.69, 9.67),
+    ('3', 'r2', 'c1', 'Italy', 'IT', 'Europe', 'Lazio',    'Rome',    41.90, 12.50),
+    ('4', 'r3', 'c2', 'Japan', 'JP', 'Asia',   'Tokyo',    'Tokyo',   35.68, 139.69),
+]
+
+CITY_PATH    = '/country/italy/lombardy/milan/'      # pagina giornaliera, in cache pagine
+COUNTRY_PATH = '/country/italy/'                      # pagina legata all'import
+
+_tmp = None
+app = None
+
+
+def setUpModule():
+    global _tmp, app
+    _tmp = tempfile.mkdtemp()
+    db_path = os.path.join(_tmp, 'cities.db')
+    # Letti all'import di db.py / sitemaps.py
+    os.environ['CITIES_DB'] = db_path
+    os.environ['SITEMAP_DIR'] = os.path.join(_tmp, 'sitemaps')
+    # I template sono cercati relativamente alla directory corrente
+    os.chdir(ROOT)
+
+    import csv_to_sqlite
+    conn = sqlite3.connect(db_path)
+    csv_to_sqlite.init_db(conn)
+    conn.executemany(f'INSERT INTO cities ({", ".join(csv_to_sqlite.COLUMNS)}) '
+                     f'VALUES ({", ".join("?" * len(csv_to_sqlite.COLUMNS))})', [
+        row + (csv_to_sqlite.slugify(row[7]), csv_to_sqlite.slugify(row[3]),
+               csv_to_sqlite.slugify(row[6]))
+        for row in CITIES])
+    conn.commit()
+    csv_to_sqlite.build_derived_tables(conn)
+    conn.close()
+
+    import app as app_module
+    app = app_module
+
+
+def tearDownModule():
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+
+def get(path, gzip=False, method='GET', **headers):
+    """GET (o method) su app.application; restituisce (status int, header dict, corpo)."""
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_NAME': 'test', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+    }
+    if gzip:
+        environ['HTTP_ACCEPT_ENCODING'] = 'gzip'
+    for name, value in headers.items():
+        environ['HTTP_' + name.upper()] = value
+    captured = []
+    result = app.application(
+        environ, lambda status, hdrs, exc_info=None: captured.append((status, hdrs)))
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    status, hdrs = captured[-1]
+    return int(status[:3]), {k.lower(): v for k, v in hdrs}, body
+
+
+def _strong(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+class ConditionalTest(unittest.TestCase):
+
+    def check_revalidation(self, path, gzip):
+        status, headers, body = get(path, gzip=gzip)
+        self.assertEqual(status, 200)
+        self.assertTrue(body)
+        etag, last_modified = headers['etag'], headers['last-modified']
+        self.assertEqual(headers.get('content-encoding') == 'gzip', gzip)
+
+        # ETag nella forma ricevuta, forte e debole
+        for tag in (etag, _strong(etag), 'W/' + _strong(etag)):
+            with self.subTest(path=path, gzip=gzip, if_none_match=tag):
+                status, headers, body = get(path, gzip=gzip, if_none_match=tag)
+                self.assertEqual(status, 304)
+                self.assertEqual(body, b'')
+                self.assertEqual(_strong(headers['etag']), _strong(etag))
+
+        with self.subTest(path=path, gzip=gzip, if_none_match='lista'):
+            status, _, _ = get(path, gzip=gzip, if_none_match='"altro", ' + etag)
+            self.assertEqual(status, 304)
+
+        with self.subTest(path=path, gzip=gzip, if_modified_since=last_modified):
+            status, _, body = get(path, gzip=gzip, if_modified_since=last_modified)
+            self.assertEqual(status, 304)
+            self.assertEqual(body, b'')
+
+        with self.subTest(path=path, gzip=gzip, if_none_match='stale'):
+            status, _, body = get(path, gzip=gzip, if_none_match='"stale-tag"')
+            self.assertEqual(status, 200)
+            self.assertTrue(body)
+
+        with self.subTest(path=path, gzip=gzip, if_modified_since='old'):
+            status, _, _ = get(path, gzip=gzip,
+                               if_modified_since='Mon, 01 Jan 2001 00:00:00 GMT')
+            self.assertEqual(status, 200)
+
+    def test_country_page(self):
+        for gzip in (False, True):
+            self.check_revalidation(COUNTRY_PATH, gzip)
+
+    def test_city_page(self):
+        for gzip in (False, True):
+            self.check_revalidation(CITY_PATH, gzip)
+
+    def test_sitemap(self):
+        for gzip in (False, True):
+            self.check_revalidation('/sitemap.xml', gzip)
+
+    def test_sitemap_other_base_url(self):
+        # File costruiti per un altro BASE_URL: resa dal DB con gli URL dell'app
+        manifest = os.path.join(os.environ['SITEMAP_DIR'], 'manifest.tsv')
+        with open(manifest, encoding='utf-8') as f:
+            saved = f.read()
+        try:
+            with open(manifest, 'w', encoding='utf-8') as f:
+                f.write(saved.replace(app.BASE_URL, 'https://altro.example'))
+            with contextlib.redirect_stderr(io.StringIO()) as err:
+                status, _, body = get('/sitemap-countries.xml')
+        finally:
+            with open(manifest, 'w', encoding='utf-8') as f:
+                f.write(saved)
+        self.assertEqual(status, 200)
+        self.assertIn((app.BASE_URL + '/country/italy/').encode(), body)
+        self.assertIn('https://altro.example', err.getvalue())
+
+    def test_page_cache_hit(self):
+        path = '/country/italy/lombardy/bergamo/sunrise/'
+        status, headers, body = get(path)
+        self.assertEqual(status, 200)
+        hits = app.page_cache.stats()['hits']
+
+        # Servita dalla cache delle pagine: stesso corpo e stessi validatori
+        status, cached_headers, cached_body = get(path)
+        self.assertEqual(status, 200)
+        self.assertEqual(app.page_cache.stats()['hits'], hits + 1)
+        self.assertEqual(cached_body, body)
+        self.assertEqual(cached_headers['etag'], headers['etag'])
+        self.assertIn('age', cached_headers)
+
+        for gzip in (False, True):
+            with self.subTest(gzip=gzip):
+                hits = app.page_cache.stats()['hits']
+                status, _, body = get(path, gzip=gzip, if_none_match=headers['etag'])
+                self.assertEqual(status, 304)
+                self.assertEqual(body, b'')
+                self.assertEqual(app.page_cache.stats()['hits'], hits + 1)
+
+                status, _, _ = get(path, gzip=gzip, if_none_match='"stale-tag"')
+                self.assertEqual(status, 200)
+
+    def test_uncompressed_keeps_strong_etag(self):
+        # robots.txt è sotto la soglia di compressione: ETag forte anche nel 304
+        status, headers, _ = get('/robots.txt', gzip=True)
+        self.assertEqual(status, 200)
+        self.assertNotIn('content-encoding', headers)
+        etag = headers['etag']
+        self.assertFalse(etag.startswith('W/'))
+        for gzip in (False, True):
+            with self.subTest(gzip=gzip):
+                status, headers, _ = get('/robots.txt', gzip=gzip, if_none_match=etag)
+                self.assertEqual(status, 304)
+                self.assertEqual(headers['etag'], etag)
+
+    def test_head_matches_get(self):
+        for path in (COUNTRY_PATH, CITY_PATH, '/robots.txt'):
+            for gzip in (False, True):
+                with self.subTest(path=path, gzip=gzip):
+                    _, get_headers, _ = get(path, gzip=gzip)
+                    status, head_headers, body = get(path, gzip=gzip, method='HEAD')
+                    self.assertEqual(status, 200)
+                    self.assertEqual(body, b'')
+                    for name in ('etag', 'content-encoding', 'vary', 'content-type'):
+                        self.assertEqual(head_headers.get(name), get_headers.get(name), name)
+
+    def test_missing_city_is_not_304(self):
+        status, _, _ = get('/country/italy/lombardy/nowhere/', if_none_match='*')
+        self.assertEqual(status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Cache giornaliera di utils (_day_cache): calcolo single-flight tra thread.
+
+Uso: python -m unittest discover -s tests
+"""
+
+import threading
+import time
+import unittest
+
+import utils
+
+N_THREADS = 16
+TIMEOUT   = 10
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def run_threads(self, key, fn):
+        """N_THREADS chiamate concorrenti di _day_cache(key, fn) partite insieme
+        dietro una barriera; restituisce i risultati (valore o eccezione)."""
+        barrier = threading.Barrier(N_THREADS)
+        results = [None] * N_THREADS
+
+        def worker(i):
+            barrier.wait()
+            try:
+                results[i] = utils._day_cache(key, fn)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(N_THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(TIMEOUT)
+            self.assertFalse(t.is_alive())
+        return results
+
+    def wait_for_waiters(self, coalesced):
+        # Chiamata dal leader dentro fn: gli altri thread devono essere in attesa
+        # del suo calcolo prima che finisca, altrimenti il test non prova nulla
+        deadline = time.monotonic() + TIMEOUT
+        while utils.day_cache_stats()['coalesced'] < coalesced + N_THREADS - 1:
+            if time.monotonic() > deadline:
+                raise AssertionError('i thread non si sono sovrapposti')
+            time.sleep(0.001)
+
+    def test_one_computation(self):
+        key = ('test_one_computation', time.monotonic())
+        coalesced = utils.day_cache_stats()['coalesced']
+        calls = []
+
+        def compute():
+            calls.append(threading.get_ident())
+            self.wait_for_waiters(coalesced)
+            return {'value': 42}
+
+        results = self.run_threads(key, compute)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(results[0], {'value': 42})
+
+        # Ora è in cache: nessun nuovo calcolo
+        self.assertIs(utils._day_cache(key, compute), results[0])
+        self.assertEqual(len(calls), 1)
+
+    def test_error_is_shared_and_retried(self):
+        key = ('test_error_is_shared_and_retried', time.monotonic())
+        coalesced = utils.day_cache_stats()['coalesced']
+        calls = []
+
+        def fail():
+            calls.append(threading.get_ident())
+            self.wait_for_waiters(coalesced)
+            raise ValueError('calcolo fallito')
+
+        results = self.run_threads(key, fail)
+        self.assertEqual(len(calls), 1)
+        self.assertIsInstance(results[0], ValueError)
+        self.assertTrue(all(r is results[0] for r in results))
+
+        # L'errore non resta in cache: la chiamata successiva ricalcola
+        self.assertEqual(utils._day_cache(key, lambda: 'ok'), 'ok')
+        self.assertEqual(utils._day_cache(key, fail), 'ok')
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Cache delle pagine di app.py (PageCacheMiddleware): validità per giorno UTC e
+generazione del DB.
+
+Uso: python -m unittest discover -s tests
+"""
+
+import io
+import sys
+import unittest
+from datetime import datetime
+from unittest import mock
+
+app = None
+
+PATH       = '/country/italy/lombardy/milan/'
+OTHER_PATH = '/country/italy/lazio/rome/'
+
+
+def setUpModule():
+    global app
+    # Importato qui: test_conditional imposta CITIES_DB prima del primo import
+    import app as app_module
+    app = app_module
+
+
+def get(wsgi_app, path=PATH):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+        'SERVER_NAME': 'test', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+    }
+    captured = []
+    body = b''.join(wsgi_app(
+        environ, lambda status, headers, exc_info=None: captured.append(status)))
+    return int(captured[-1][:3]), body
+
+
+class PageCacheValidityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.generation = 0
+        self.renders = 0
+        self.during_render = None
+        patcher = mock.patch.object(app.db, 'data_generation', lambda: self.generation)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = app.PageCacheMiddleware(self.render, max_bytes=2**20)
+
+    def render(self, environ, start_response):
+        self.renders += 1
+        body = f'gen {self.generation}'.encode()
+        if self.during_render is not None:
+            hook, self.during_render = self.during_render, None
+            hook()
+        start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8'),
+                                  ('ETag', f'"g{body[4:].decode()}"')])
+        return [body]
+
+    def other_request(self):
+        # Richiesta concorrente su un'altra pagina: svuota la cache scaduta
+        get(self.cache, OTHER_PATH)
+
+    def test_cached_within_generation(self):
+        self.assertEqual(get(self.cache), (200, b'gen 0'))
+        self.assertEqual(get(self.cache), (200, b'gen 0'))
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_new_generation_clears_entries(self):
+        get(self.cache)
+        self.generation += 1
+        self.assertEqual(get(self.cache), (200, b'gen 1'))
+        self.assertEqual(self.renders, 2)
+
+    def test_render_across_db_change_is_not_stored(self):
+        def reload_db():
+            self.generation += 1
+            self.other_request()
+
+        self.during_render = reload_db
+        self.assertEqual(get(self.cache), (200, b'gen 0'))
+        # Resta solo la pagina resa dopo il cambio
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        self.assertEqual(get(self.cache), (200, b'gen 1'))
+        self.assertEqual(self.renders, 3)
+
+    def test_render_across_midnight_is_not_stored(self):
+        today = [datetime(2026, 1, 1, 23, 59, 59)]
+
+        class FakeDatetime:
+            @staticmethod
+            def utcnow():
+                return today[0]
+
+        def midnight():
+            today[0] = datetime(2026, 1, 2, 0, 0, 1)
+            self.other_request()
+
+        self.during_render = midnight
+        with mock.patch.object(app, 'datetime', FakeDatetime):
+            get(self.cache)
+            self.assertEqual(self.cache.stats()['entries'], 1)
+            get(self.cache)
+        self.assertEqual(self.renders, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Schema di cities.db: le tabelle derivate (R*Tree, FTS5, sitemap_chunks) sono
+legate a cities.id e restano coerenti dopo DELETE + VACUUM; migrazione dei DB
+creati senza cities.id.
+
+Uso: python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+csv_to_sqlite = None
+
+CITIES = [
+    ('c%03d' % i, 'r1', 'k1', 'Italy', 'IT', 'Europe', 'Lombardy', f'Town{i:03d}',
+     45.0 + i / 100, 9.0 + i / 100)
+    for i in range(60)
+]
+
+
+def setUpModule():
+    global csv_to_sqlite
+    # Importato qui: importa sitemaps, che legge SITEMAP_DIR (vedi test_conditional)
+    import csv_to_sqlite as module
+    csv_to_sqlite = module
+
+
+def _rows():
+    return [row + (csv_to_sqlite.slugify(row[7]), csv_to_sqlite.slugify(row[3]),
+                   csv_to_sqlite.slugify(row[6])) for row in CITIES]
+
+
+class SchemaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.conn = sqlite3.connect(os.path.join(self.tmp, 'cities.db'))
+        self.addCleanup(self.conn.close)
+
+    def build(self):
+        # Le tabelle derivate legate a cities.id (senza i file sitemap)
+        with self.conn:
+            csv_to_sqlite.build_spatial_index(self.conn)
+            csv_to_sqlite.build_search_index(self.conn)
+            csv_to_sqlite.build_sitemap_chunks(self.conn)
+
+    def check_derived(self):
+        conn = self.conn
+        # R*Tree: ogni id punta alla città con le stesse coordinate (l'R*Tree
+        # le conserva in precisione singola)
+        mismatched = conn.execute('''
+            SELECT COUNT(*) FROM cities_rtree r LEFT JOIN cities c ON c.id = r.id
+            WHERE  c.id IS NULL OR ABS(r.min_lat - c.latitude) > 1e-4
+               OR  ABS(r.min_lon - c.longitude) > 1e-4
+        ''').fetchone()[0]
+        self.assertEqual(mismatched, 0)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM cities_rtree').fetchone()[0],
+                         conn.execute('SELECT COUNT(*) FROM cities').fetchone()[0])
+
+        # FTS5: il rowid di ogni risultato è la città con quel nome
+        for name in ('Town007', 'Town042', 'Town059'):
+            found = conn.execute('''
+                SELECT c.cityname FROM cities_fts f JOIN cities c ON c.id = f.rowid
+                WHERE  f.cityname LIKE ?
+            ''', (f'%{name[1:]}%',)).fetchall()
+            expected = conn.execute('SELECT COUNT(*) FROM cities WHERE cityname = ?',
+                                    (name,)).fetchone()[0]
+            self.assertEqual([r[0] for r in found], [name] * expected)
+
+        # sitemap_chunks: ogni città esattamente una volta
+        covered = conn.execute('''
+            SELECT COUNT(*) FROM cities c JOIN sitemap_chunks s
+              ON c.id BETWEEN s.min_id AND s.max_id
+        ''').fetchone()[0]
+        self.assertEqual(covered, conn.execute('SELECT COUNT(*) FROM cities').fetchone()[0])
+
+    def test_vacuum_keeps_derived_tables(self):
+        conn = self.conn
+        csv_to_sqlite.init_db(conn)
+        conn.executemany(f'INSERT INTO cities ({", ".join(csv_to_sqlite.COLUMNS)}) '
+                         f'VALUES ({", ".join("?" * len(csv_to_sqlite.COLUMNS))})', _rows())
+        conn.commit()
+
+        # Come fix_regions --apply (DELETE e ricostruzione), poi una manutenzione
+        # di routine: VACUUM rinumererebbe i rowid impliciti lasciati dai buchi
+        conn.execute("DELETE FROM cities WHERE cityid IN ('c000', 'c001', 'c013', 'c040')")
+        conn.commit()
+        self.build()
+        conn.execute('VACUUM')
+        self.check_derived()
+
+    def test_migration_from_implicit_rowid(self):
+        conn = self.conn
+        conn.execute(f'''
+            CREATE TABLE cities (cityid TEXT PRIMARY KEY,
+                                 {", ".join(csv_to_sqlite.COLUMNS[1:])})
+        ''')
+        conn.executemany(f'INSERT INTO cities VALUES ({", ".join("?" * 13)})', _rows())
+        conn.execute("DELETE FROM cities WHERE cityid IN ('c002', 'c030')")
+        conn.commit()
+        before = conn.execute('SELECT rowid, cityid FROM cities ORDER BY rowid').fetchall()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            csv_to_sqlite.init_db(conn)
+        self.assertEqual(conn.execute('SELECT id, cityid FROM cities ORDER BY id').fetchall(),
+                         before)
+        self.assertIsNone(conn.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'cities_old'").fetchone())
+        with self.assertRaises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO cities (cityid) VALUES ('c003')")
+
+        self.build()
+        conn.execute('VACUUM')
+        self.check_derived()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+solar.py contro le formule scalari originali (utils._sun_calc e
+utils._time_at_elevation prima del motore a lotti), tenute qui come riferimento.
+
+Uso: python -m unittest discover -s tests
+"""
+
+import math
+import unittest
+
+import solar
+
+# Coordinate campione (griglia deterministica) più i casi limite: poli, e
+# latitudini dove il sole è appena circumpolare in qualche giorno dell'anno
+COORDS = [(lat, lon) for lat in range(-87, 90, 8) for lon in (-179.5, -73.9, 0.0, 12.5, 139.7)]
+EDGES  = [(90.0, 0.0), (-90.0, 0.0), (78.2, 15.6), (-78.2, 15.6), (-77.8, 166.7),
+          (66.6, 25.7), (-66.6, 25.7), (0.0, 0.0)]
+DAYS   = list(range(1, 367))
+ELEVATIONS = [solar.ASTRONOMICAL, solar.NAUTICAL, solar.CIVIL, solar.BLUE_END,
+              solar.HORIZON, solar.GOLDEN_END]
+TOLERANCE = 1e-9    # ore
+
+
+# ── Riferimento scalare ───────────────────────────────────────────
+
+def _ref_terms(lat, lon, N, sin_h0):
+    decl = 23.45 * math.sin(math.radians(360 / 365 * (N - 81)))
+    cos_H_num = sin_h0 - math.sin(math.radians(lat)) * math.sin(math.radians(decl))
+    cos_H_den = math.cos(math.radians(lat)) * math.cos(math.radians(decl))
+    B = math.radians(360 / 365 * (N - 81))
+    EoT = 9.87 * math.sin(2 * B) - 7.53 * math.cos(B) - 1.5 * math.sin(B)
+    solar_noon = 12 - lon / 15 - EoT / 60
+    cos_H = cos_H_num / cos_H_den if cos_H_den else None
+    return cos_H, solar_noon
+
+
+def ref_sun_times(lat, lon, N):
+    """(rise, set, length, status) con la formula di utils._sun_calc."""
+    cos_H, solar_noon = _ref_terms(lat, lon, N, math.cos(math.radians(90.833)))
+    if cos_H is None:
+        return None, None, None, solar.NA
+    if cos_H < -1:
+        return None, None, None, solar.MIDNIGHT_SUN
+    if cos_H > 1:
+        return None, None, None, solar.POLAR_NIGHT
+    H_hours = math.degrees(math.acos(cos_H)) / 15
+    return (solar_noon - H_hours) % 24, (solar_noon + H_hours) % 24, 2 * H_hours, solar.OK
+
+
+def ref_elevation_times(lat, lon, N, elev_deg):
+    """(mattino, sera) con la formula di utils._time_at_elevation."""
+    cos_H, solar_noon = _ref_terms(lat, lon, N, math.sin(math.radians(elev_deg)))
+    if cos_H is None or abs(cos_H) > 1:
+        return None, None
+    H_hours = math.degrees(math.acos(cos_H)) / 15
+    return (solar_noon - H_hours) % 24, (solar_noon + H_hours) % 24
+
+
+def _borderline(lat, lon, N, elev_deg):
+    # |cos_H| a un soffio da 1: l'esito può dipendere dall'ultimo bit
+    cos_H, _ = _ref_terms(lat, lon, N, math.sin(math.radians(elev_deg)))
+    return cos_H is not None and abs(abs(cos_H) - 1) < 1e-12
+
+
+# ── Test ──────────────────────────────────────────────────────────
+
+class _Checks(unittest.TestCase):
+    engine = None
+
+    def assertHours(self, got, expected, msg=None):
+        if expected is None or got is None:
+            self.assertEqual(got, expected, msg)
+        else:
+            d = abs(got - expected)
+            self.assertLess(min(d, 24 - d), TOLERANCE, msg)     # 23.9999… ≡ 0.0000…
+
+    def check_sun_times(self, coords):
+        for lat, lon in coords:
+            rise, sset, length, status = solar.sun_times(lat, lon, DAYS, engine=self.engine)
+            for i, N in enumerate(DAYS):
+                if self.engine == 'numpy' and _borderline(lat, lon, N, -0.833):
+                    continue
+                msg = f'lat={lat} lon={lon} N={N}'
+                ref = ref_sun_times(lat, lon, N)
+                self.assertEqual(status[i], ref[3], msg)
+                for got, expected in zip((rise[i], sset[i], length[i]), ref[:3]):
+                    self.assertHours(got, expected, msg)
+
+    def check_elevation_times(self, coords):
+        for lat, lon in coords:
+            for elev in ELEVATIONS:
+                morning, evening = solar.elevation_times(lat, lon, DAYS, elev,
+                                                         engine=self.engine)
+                for i, N in enumerate(DAYS):
+                    if self.engine == 'numpy' and _borderline(lat, lon, N, elev):
+                        continue
+                    msg = f'lat={lat} lon={lon} N={N} elev={elev}'
+                    ref = ref_elevation_times(lat, lon, N, elev)
+                    self.assertHours(morning[i], ref[0], msg)
+                    self.assertHours(evening[i], ref[1], msg)
+
+    def check_elevation_list(self, coords):
+        # Più soglie per lo stesso giorno e la stessa coordinata
+        for lat, lon in coords:
+            for N in (1, 80, 172, 266, 355):
+                morning, evening = solar.elevation_times(lat, lon, N, ELEVATIONS,
+                                                         engine=self.engine)
+                for j, elev in enumerate(ELEVATIONS):
+                    if self.engine == 'numpy' and _borderline(lat, lon, N, elev):
+                        continue
+                    msg = f'lat={lat} lon={lon} N={N} elev={elev}'
+                    ref = ref_elevation_times(lat, lon, N, elev)
+                    self.assertHours(morning[j], ref[0], msg)
+                    self.assertHours(evening[j], ref[1], msg)
+
+
+class PythonEngineTest(_Checks):
+    engine = 'python'
+
+    def test_sun_times(self):
+        self.check_sun_times(COORDS)
+
+    def test_sun_times_edges(self):
+        self.check_sun_times(EDGES)
+
+    def test_elevation_times(self):
+        self.check_elevation_times(COORDS + EDGES)
+
+    def test_elevation_list(self):
+        self.check_elevation_list(COORDS + EDGES)
+
+    def test_elevation_crossings(self):
+        for lat, lon in COORDS + EDGES:
+            for N in DAYS:
+                got = solar.elevation_crossings(lat, lon, N, ELEVATIONS)
+                for (morning, evening), elev in zip(got, ELEVATIONS):
+                    msg = f'lat={lat} lon={lon} N={N} elev={elev}'
+                    ref = ref_elevation_times(lat, lon, N, elev)
+                    self.assertHours(morning, ref[0], msg)
+                    self.assertHours(evening, ref[1], msg)
+
+    def test_vectorized_coords(self):
+        # Una sequenza di coordinate per lo stesso giorno
+        lats, lons = [c[0] for c in COORDS + EDGES], [c[1] for c in COORDS + EDGES]
+        rise, sset, length, status = solar.sun_times(lats, lons, 172, engine=self.engine)
+        for i, (lat, lon) in enumerate(zip(lats, lons)):
+            ref = ref_sun_times(lat, lon, 172)
+            self.assertEqual(status[i], ref[3])
+            for got, expected in zip((rise[i], sset[i], length[i]), ref[:3]):
+                self.assertHours(got, expected)
+
+    def test_scalar(self):
+        rise, sset, length, status = solar.sun_times(45.46, 9.19, 172, engine=self.engine)
+        ref = ref_sun_times(45.46, 9.19, 172)
+        self.assertEqual(status, solar.OK)
+        for got, expected in zip((rise, sset, length), ref[:3]):
+            self.assertHours(got, expected)
+
+
+@unittest.skipIf(solar.np is None, 'NumPy non installato')
+class NumpyEngineTest(_Checks):
+    engine = 'numpy'
+
+    def test_sun_times(self):
+        self.check_sun_times(COORDS + EDGES)
+
+    def test_elevation_times(self):
+        self.check_elevation_times(COORDS + EDGES)
+
+    def test_elevation_list(self):
+        self.check_elevation_list(COORDS + EDGES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,27 +1,155 @@
 import unicodedata
 import re
 import math
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime
 
+import solar
+
 
 # ---------------------------------------------------------------------------
 # Cache in-process con TTL giornaliero (svuotata automaticamente a mezzanotte UTC)
 # ---------------------------------------------------------------------------
-
-_CACHE: dict = {}
+# LRU limitata per numero di voci (DAY_CACHE_ENTRIES) e per dimensione stimata
+# dei valori (DAY_CACHE_MB): un crawler che visita tutte le città non la fa
+# crescere oltre il budget. La dimensione è misurata al primo inserimento di
+# ogni tipo di voce (primo elemento della chiave: i valori di una stessa
+# funzione hanno dimensioni quasi uguali) e poi riusata. Al cambio di giorno
+# UTC il dizionario viene sostituito in blocco (O(1)); i valori restituiti sono
+# condivisi tra le richieste e non vanno modificati.
+# Calcolo single-flight: se più thread mancano la stessa chiave (tipicamente
+# moon_phase e le città più visitate subito dopo la mezzanotte UTC) solo il
+# primo esegue fn(), gli altri attendono il suo risultato (o la sua eccezione).
+
+DAY_CACHE_ENTRIES = int(os.environ.get('DAY_CACHE_ENTRIES', 20000))
+DAY_CACHE_MB      = float(os.environ.get('DAY_CACHE_MB', 64))
+
+
+def _approx_size(value):
+    """Dimensione approssimata in byte di value (contenitori annidati inclusi)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_approx_size(k) + _approx_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_approx_size(v) for v in value)
+    return size
+
+
+class _DayCache:
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.hits        = 0
+        self.misses      = 0
+        self.evictions   = 0
+        self.rollovers   = 0
+        self.coalesced   = 0
+        self._day        = None
+        self._data       = OrderedDict()    # chiave → (valore, byte)
+        self._bytes      = 0
+        self._sizes      = {}               # tipo di voce → byte stimati
+        self._flights    = {}               # (giorno, chiave) → Future del calcolo in corso
+        self._lock       = threading.Lock()
+
+    def _roll(self, day):
+        # Chiamata con il lock preso: le voci del giorno precedente spariscono
+        # insieme al vecchio dizionario
+        if self._day is None or day > self._day:
+            if self._day is not None:
+                self.rollovers += 1
+            self._day   = day
+            self._data  = OrderedDict()
+            self._bytes = 0
+
+    def get_or_compute(self, key, day, fn):
+        with self._lock:
+            self._roll(day)
+            entry = self._data.get(key) if day == self._day else None
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            flight = self._flights.get((day, key))
+            leader = flight is None
+            if leader:
+                flight = self._flights[(day, key)] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.result()
+        try:
+            value = fn()
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            self.put(key, value, day)
+            flight.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._flights[(day, key)]
+
+    def put(self, key, value, day):
+        kind = key[0] if isinstance(key, tuple) else key
+        size = self._sizes.get(kind)
+        if size is None:
+            size = self._sizes[kind] = _approx_size(value)
+        with self._lock:
+            self._roll(day)
+            if day != self._day or size > self.max_bytes:
+                return      # calcolato per un giorno già passato, o troppo grande
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0,
+                    'coalesced': self.coalesced,
+                    'evictions': self.evictions, 'rollovers': self.rollovers,
+                    'entries': len(self._data), 'bytes': self._bytes,
+                    'max_entries': self.max_entries, 'max_bytes': self.max_bytes}
+
+
+_CACHE = _DayCache(DAY_CACHE_ENTRIES, int(DAY_CACHE_MB * 1024 * 1024))
+
+
+def _reset_after_fork():
+    # I calcoli in corso appartenevano a thread del padre, assenti nel figlio
+    _CACHE._lock    = threading.Lock()
+    _CACHE._flights = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 def _day_cache(key, fn):
-    """Esegue fn() la prima volta per la data odierna, poi restituisce il valore
-    memorizzato. Svuota automaticamente le voci del giorno precedente (lazy cleanup)."""
-    today = datetime.utcnow().strftime('%Y-%m-%d')
-    full_key = (today, key)
-    if full_key not in _CACHE:
-        stale = [k for k in list(_CACHE) if k[0] != today]
-        for k in stale:
-            del _CACHE[k]
-        _CACHE[full_key] = fn()
-    return _CACHE[full_key]
+    """Esegue fn() la prima volta per la data odierna (UTC), poi restituisce il
+    valore memorizzato finché resta nel budget della cache. Chiamate concorrenti
+    per la stessa chiave attendono un unico calcolo."""
+    return _CACHE.get_or_compute(key, int(time.time() // 86400), fn)
+
+
+def day_cache_stats():
+    """Hit/miss, calcoli condivisi, evizioni, cambi di giorno e occupazione della
+    cache giornaliera."""
+    return _CACHE.stats()
 
 
 def slugify(text):
@@ -251,29 +379,27 @@ def _fmt_duration(hours):
     return f'{h}h {m:02d}m'
 
 
+_SUN_SPECIAL = {solar.MIDNIGHT_SUN: 'midnight_sun', solar.POLAR_NIGHT: 'polar_night',
+                solar.NA: 'na'}
+
+
 def _sun_calc(lat, lon, N):
     """
     Core del calcolo alba/tramonto dato il giorno dell'anno N (1–365).
     Restituisce (rise_h, set_h, day_length_hours) oppure
     ('midnight_sun', …) o ('polar_night', …) come stringa speciale nel primo valore.
     """
-    decl = 23.45 * math.sin(math.radians(360 / 365 * (N - 81)))
-    cos_H_num = (math.cos(math.radians(90.833)) -
-                 math.sin(math.radians(lat)) * math.sin(math.radians(decl)))
-    cos_H_den = (math.cos(math.radians(lat)) * math.cos(math.radians(decl)))
-    if cos_H_den == 0:
-        return 'na', None, None
-    cos_H = cos_H_num / cos_H_den
-    if cos_H < -1:
-        return 'midnight_sun', None, None
-    if cos_H > 1:
-        return 'polar_night', None, None
-    H = math.degrees(math.acos(cos_H))
-    B = math.radians(360 / 365 * (N - 81))
-    EoT = 9.87 * math.sin(2 * B) - 7.53 * math.cos(B) - 1.5 * math.sin(B)
-    solar_noon = 12 - lon / 15 - EoT / 60
-    H_hours = H / 15
-    return (solar_noon - H_hours) % 24, (solar_noon + H_hours) % 24, 2 * H_hours
+    rise, sset, length, status = solar.sun_times(lat, lon, N)
+    if status != solar.OK:
+        return _SUN_SPECIAL[status], None, None
+    return rise, sset, length
+
+
+def _sun_calc_days(lat, lon, days):
+    """_sun_calc per una lista di giorni dell'anno, in un'unica chiamata a solar."""
+    rises, ssets, lengths, statuses = solar.sun_times(lat, lon, days)
+    return [(rise, sset, length) if status == solar.OK else (_SUN_SPECIAL[status], None, None)
+            for rise, sset, length, status in zip(rises, ssets, lengths, statuses)]
 
 
 def _compute_sunrise_sunset(lat, lon):
@@ -303,7 +429,10 @@ def sunrise_sunset_for_date(lat, lon, year, month, day):
     """
     from datetime import date as _date
     N = _date(year, month, day).timetuple().tm_yday
-    rise, sset, length = _sun_calc(lat, lon, N)
+    return _fmt_sun_day(*_sun_calc(lat, lon, N))
+
+
+def _fmt_sun_day(rise, sset, length):
     if rise == 'midnight_sun':
         return '☀️ all day', '—', '24h 00m'
     if rise == 'polar_night':
@@ -313,12 +442,15 @@ def sunrise_sunset_for_date(lat, lon, year, month, day):
     return _fmt_time(rise), _fmt_time(sset), _fmt_duration(length)
 
 
-def _compute_sun_calendar(lat, lon):
+def _compute_sun_calendar_days():
+    """Parte del calendario uguale per tutte le città: per ognuno dei 3 mesi
+    (year, month, month_name, giorni), ogni giorno come
+    (day, dow, date_iso, is_today, moon, giorno dell'anno)."""
     import calendar as _cal
     from datetime import date as _date
 
     today = datetime.utcnow().date()
-    result = []
+    months = []
 
     for delta in (-1, 0, 1):
         m = today.month + delta
@@ -330,20 +462,34 @@ def _compute_sun_calendar(lat, lon):
             m -= 12
             y += 1
         _, days_in_month = _cal.monthrange(y, m)
-        month_name = _date(y, m, 1).strftime('%B')
         days = []
         for d in range(1, days_in_month + 1):
             date_obj = _date(y, m, d)
-            rise, sset, length = sunrise_sunset_for_date(lat, lon, y, m, d)
+            days.append((d, date_obj.strftime('%a'), date_obj.isoformat(),
+                         date_obj == today, _moon_emoji_for_date(y, m, d),
+                         date_obj.timetuple().tm_yday))
+        months.append((y, m, _date(y, m, 1).strftime('%B'), days))
+    return months
+
+
+def _compute_sun_calendar(lat, lon):
+    months = _day_cache('sun_calendar_days', _compute_sun_calendar_days)
+    # Alba/tramonto dei ~90 giorni in un'unica chiamata (vettoriale con NumPy)
+    suns = iter(_sun_calc_days(lat, lon, [day[5] for *_, days in months for day in days]))
+    result = []
+    for y, m, month_name, month_days in months:
+        days = []
+        for d, dow, date_iso, is_today, moon, _ in month_days:
+            rise, sset, length = _fmt_sun_day(*next(suns))
             days.append({
                 'day':        d,
-                'dow':        date_obj.strftime('%a'),
-                'date_iso':   date_obj.isoformat(),
+                'dow':        dow,
+                'date_iso':   date_iso,
                 'sunrise':    rise,
                 'sunset':     sset,
                 'day_length': length,
-                'is_today':   date_obj == today,
-                'moon':       _moon_emoji_for_date(y, m, d),
+                'is_today':   is_today,
+                'moon':       moon,
             })
         result.append({
             'year':       y,
@@ -412,62 +558,44 @@ def moon_phase():
 
 
 # ---------------------------------------------------------------------------
-# GOLDEN HOUR & BLUE HOUR
+# GOLDEN HOUR, BLUE HOUR & CREPUSCOLI
 # ---------------------------------------------------------------------------
 
-def _time_at_elevation(lat, lon, elev_deg, N, morning=True):
-    """Ora UTC (float) in cui il sole raggiunge elev_deg gradi di elevazione.
-    morning=True per l'evento mattutino, False per quello serale.
-    Restituisce None se il sole non raggiunge quell'elevazione."""
-    decl = 23.45 * math.sin(math.radians(360 / 365 * (N - 81)))
-    cos_H_num = (math.sin(math.radians(elev_deg)) -
-                 math.sin(math.radians(lat)) * math.sin(math.radians(decl)))
-    cos_H_den = (math.cos(math.radians(lat)) * math.cos(math.radians(decl)))
-    if cos_H_den == 0:
-        return None
-    cos_H = cos_H_num / cos_H_den
-    if abs(cos_H) > 1:
-        return None
-    H = math.degrees(math.acos(cos_H))
-    B = math.radians(360 / 365 * (N - 81))
-    EoT = 9.87 * math.sin(2 * B) - 7.53 * math.cos(B) - 1.5 * math.sin(B)
-    solar_noon = 12 - lon / 15 - EoT / 60
-    return (solar_noon - H / 15) % 24 if morning else (solar_noon + H / 15) % 24
-
-
 def _compute_golden_hour(lat, lon):
     today = datetime.utcnow()
     N = today.timetuple().tm_yday
 
-    def fmt(h):
-        return _fmt_time(h) if h is not None else 'N/A'
-
-    def rnd(h):
-        return round(h, 3) if h is not None else None
-
-    bms = _time_at_elevation(lat, lon, -6.0,   N, morning=True)
-    bme = _time_at_elevation(lat, lon, -4.0,   N, morning=True)
-    gms = _time_at_elevation(lat, lon, -0.833, N, morning=True)
-    gme = _time_at_elevation(lat, lon,  6.0,   N, morning=True)
-    ges = _time_at_elevation(lat, lon,  6.0,   N, morning=False)
-    gee = _time_at_elevation(lat, lon, -0.833, N, morning=False)
-    bes = _time_at_elevation(lat, lon, -4.0,   N, morning=False)
-    bee = _time_at_elevation(lat, lon, -6.0,   N, morning=False)
-
-    return {
-        'blue_morning_start':    fmt(bms), 'blue_morning_start_h':    rnd(bms),
-        'blue_morning_end':      fmt(bme), 'blue_morning_end_h':      rnd(bme),
-        'golden_morning_start':  fmt(gms), 'golden_morning_start_h':  rnd(gms),
-        'golden_morning_end':    fmt(gme), 'golden_morning_end_h':    rnd(gme),
-        'golden_evening_start':  fmt(ges), 'golden_evening_start_h':  rnd(ges),
-        'golden_evening_end':    fmt(gee), 'golden_evening_end_h':    rnd(gee),
-        'blue_evening_start':    fmt(bes), 'blue_evening_start_h':    rnd(bes),
-        'blue_evening_end':      fmt(bee), 'blue_evening_end_h':      rnd(bee),
+    # Tutte le soglie in una passata: (mattino, sera) per ciascuna
+    (ams, aee), (nms, nee), (bms, bee), (bme, bes), (gms, gee), (gme, ges) = \
+        solar.elevation_crossings(lat, lon, N, [
+            solar.ASTRONOMICAL, solar.NAUTICAL, solar.CIVIL,
+            solar.BLUE_END, solar.HORIZON, solar.GOLDEN_END])
+
+    # Fascia → (inizio, fine); i crepuscoli del mattino salgono da −18° a −0.833°,
+    # quelli della sera scendono
+    bands = {
+        'astronomical_morning': (ams, nms),
+        'nautical_morning':     (nms, bms),
+        'civil_morning':        (bms, gms),
+        'blue_morning':         (bms, bme),
+        'golden_morning':       (gms, gme),
+        'golden_evening':       (ges, gee),
+        'blue_evening':         (bes, bee),
+        'civil_evening':        (gee, bee),
+        'nautical_evening':     (bee, nee),
+        'astronomical_evening': (nee, aee),
     }
+    formatted = {h: (_fmt_time(h), round(h, 3)) if h is not None else ('N/A', None)
+                 for h in (ams, nms, bms, bme, gms, gme, ges, gee, bes, bee, nee, aee)}
+    result = {}
+    for band, edges in bands.items():
+        for edge, h in zip(('start', 'end'), edges):
+            result[f'{band}_{edge}'], result[f'{band}_{edge}_h'] = formatted[h]
+    return result
 
 
 def golden_hour(lat, lon):
-    """Golden hour e blue hour per oggi (cached giornalmente per coordinate)."""
+    """Golden hour, blue hour e crepuscoli per oggi (cached giornalmente per coordinate)."""
     return _day_cache(('golden_hour', lat, lon),
                       lambda: _compute_golden_hour(lat, lon))
 
@@ -504,13 +632,19 @@ def current_season(lat):
 # TABELLA LUCE ANNUALE (12 mesi)
 # ---------------------------------------------------------------------------
 
-def _compute_annual_daylight(lat, lon, utc_offset=0):
-    from datetime import date as _date
+def _compute_annual_daylight_days():
+    """(month, giorno dell'anno, month_name, month_short) del 15 di ogni mese."""
     year = datetime.utcnow().year
+    return [(m, datetime(year, m, 15).timetuple().tm_yday,
+             datetime(year, m, 15).strftime('%B'), datetime(year, m, 15).strftime('%b'))
+            for m in range(1, 13)]
+
+
+def _compute_annual_daylight(lat, lon, utc_offset=0):
+    months = _day_cache('annual_daylight_days', _compute_annual_daylight_days)
     result = []
-    for m in range(1, 13):
-        N = _date(year, m, 15).timetuple().tm_yday
-        rise, sset, length = _sun_calc(lat, lon, N)
+    suns = _sun_calc_days(lat, lon, [N for _, N, _, _ in months])
+    for (m, _, month_name, month_short), (rise, sset, length) in zip(months, suns):
         if rise == 'midnight_sun':
             rise_fmt, sset_fmt, length_fmt = '☀️ all day', '—', '24h 00m'
             dl_h, rise_h, sset_h = 24.0, 0.0, 24.0
@@ -531,8 +665,8 @@ def _compute_annual_daylight(lat, lon, utc_offset=0):
             sset_h = round(local_sset, 3)
         result.append({
             'month': m,
-            'month_name': datetime(year, m, 15).strftime('%B'),
-            'month_short': datetime(year, m, 15).strftime('%b'),
+            'month_name': month_name,
+            'month_short': month_short,
             'sunrise': rise_fmt,
             'sunset': sset_fmt,
             'day_length': length_fmt,
@@ -8,16 +8,16 @@
   % if defined('canonical'):
   <link rel="canonical" href="{{canonical}}">
   % end
-  <link rel="stylesheet" href="/static/css/style.css">
+  <link rel="stylesheet" href="{{asset_url('css/style.css')}}">
   % if defined('schema_json'):
   <script type="application/ld+json">{{!schema_json}}</script>
   % end
   % if defined('use_leaflet') and use_leaflet:
-  <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
-  <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+  <link rel="stylesheet" href="{{asset_url('vendor/leaflet/leaflet.css')}}"/>
+  <script src="{{asset_url('vendor/leaflet/leaflet.js')}}"></script>
   % end
   % if defined('use_chartjs') and use_chartjs:
-  <script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js"></script>
+  <script src="{{asset_url('vendor/chartjs/chart.umd.min.js')}}"></script>
   % end
 </head>
 <body>
@@ -42,6 +42,9 @@
       <strong>{{golden['golden_evening_end']}}</strong> (UTC).
       The <strong>blue hour</strong> occurs just before and after these windows,
       offering a cooler, softer natural light beloved by photographers.
+      First light (start of astronomical twilight) is at
+      <strong>{{golden['astronomical_morning_start']}}</strong> and the sky is fully dark
+      again after <strong>{{golden['astronomical_evening_end']}}</strong>.
       All times are in Coordinated Universal Time (UTC).
     </p>
   </section>
@@ -51,8 +54,9 @@
     <h2>Day Timeline – {{city['cityname']}}</h2>
     <p class="section-intro">
       The chart below shows how light conditions change throughout the day in
-      <strong>{{city['cityname']}}</strong>. From night to blue hour, golden hour,
-      full daylight, and back again — find the best times for outdoor photography.
+      <strong>{{city['cityname']}}</strong>. From night through astronomical, nautical and
+      civil twilight, blue hour, golden hour, full daylight, and back again — find the best
+      times for outdoor photography and stargazing.
     </p>
     <div class="chart-container">
       <canvas id="goldenChart"></canvas>
@@ -68,6 +72,18 @@
       <div class="golden-panel golden-panel--morning">
         <h3>🌄 Morning</h3>
         <table class="coords-table">
+          <tr>
+            <th>🌌 Astronomical Twilight</th>
+            <td>{{golden['astronomical_morning_start']}} – {{golden['astronomical_morning_end']}}</td>
+          </tr>
+          <tr>
+            <th>⚓ Nautical Twilight</th>
+            <td>{{golden['nautical_morning_start']}} – {{golden['nautical_morning_end']}}</td>
+          </tr>
+          <tr>
+            <th>🌆 Civil Twilight</th>
+            <td>{{golden['civil_morning_start']}} – {{golden['civil_morning_end']}}</td>
+          </tr>
           <tr>
             <th>🌑 Blue Hour</th>
             <td>{{golden['blue_morning_start']}} – {{golden['blue_morning_end']}}</td>
@@ -98,6 +114,18 @@
             <th>🌃 Blue Hour</th>
             <td>{{golden['blue_evening_start']}} – {{golden['blue_evening_end']}}</td>
           </tr>
+          <tr>
+            <th>🌆 Civil Twilight</th>
+            <td>{{golden['civil_evening_start']}} – {{golden['civil_evening_end']}}</td>
+          </tr>
+          <tr>
+            <th>⚓ Nautical Twilight</th>
+            <td>{{golden['nautical_evening_start']}} – {{golden['nautical_evening_end']}}</td>
+          </tr>
+          <tr>
+            <th>🌌 Astronomical Twilight</th>
+            <td>{{golden['astronomical_evening_start']}} – {{golden['astronomical_evening_end']}}</td>
+          </tr>
         </table>
       </div>
 
@@ -115,6 +143,10 @@
       landscape photography, portrait work, and cinematography.
       The <strong>blue hour</strong> occurs when the sun is slightly below the horizon (between
       −6° and −4° elevation), casting an even, diffused blue light over the landscape.
+      Twilight covers the whole time the sun is less than 18° below the horizon: the sky
+      is never fully dark during <strong>astronomical</strong> twilight, the horizon is
+      visible at sea during <strong>nautical</strong> twilight, and outdoor activities need
+      no artificial light during <strong>civil</strong> twilight.
     </p>
     <table class="coords-table">
       <tr>
@@ -125,6 +157,18 @@
         <th>Blue Hour</th>
         <td>Sun elevation between −6° and −4° below horizon</td>
       </tr>
+      <tr>
+        <th>Civil Twilight</th>
+        <td>Sun elevation between −6° and sunrise/sunset</td>
+      </tr>
+      <tr>
+        <th>Nautical Twilight</th>
+        <td>Sun elevation between −12° and −6° below horizon</td>
+      </tr>
+      <tr>
+        <th>Astronomical Twilight</th>
+        <td>Sun elevation between −18° and −12° below horizon</td>
+      </tr>
       <tr>
         <th>Today's date</th>
         <td>{{geo['sun_date']}}</td>
@@ -147,6 +191,8 @@
 % if has_coords and golden:
 <script>
 (function() {
+  var ams = {{!_json.dumps(golden.get('astronomical_morning_start_h', 0))}};
+  var nms = {{!_json.dumps(golden.get('nautical_morning_start_h',     0))}};
   var bms = {{!_json.dumps(golden.get('blue_morning_start_h',   0))}};
   var bme = {{!_json.dumps(golden.get('blue_morning_end_h',     0))}};
   var gms = {{!_json.dumps(golden.get('golden_morning_start_h', 0))}};
@@ -155,6 +201,8 @@
   var gee = {{!_json.dumps(golden.get('golden_evening_end_h',   0))}};
   var bes = {{!_json.dumps(golden.get('blue_evening_start_h',   0))}};
   var bee = {{!_json.dumps(golden.get('blue_evening_end_h',     0))}};
+  var nee = {{!_json.dumps(golden.get('nautical_evening_end_h',     0))}};
+  var aee = {{!_json.dumps(golden.get('astronomical_evening_end_h', 0))}};
 
   function hToHHMM(h) {
     if (h == null || isNaN(h)) return '';
@@ -162,16 +210,23 @@
     return String(hh).padStart(2,'0') + ':' + String(mm).padStart(2,'0');
   }
 
-  // Build floating-bar segments [start, end]
+  // Build floating-bar segments [start, end]; blue hour is drawn over civil twilight.
+  // Segments the sun never reaches today (e.g. no full night in polar summer) are skipped.
   var segments = [
-    { label: 'Night',               color: '#1a2044', data: [0,   bms] },
-    { label: 'Blue Hour (morning)', color: '#4d6fcb', data: [bms, bme] },
-    { label: 'Golden Hour (morning)', color: '#f5a623', data: [gms, gme] },
-    { label: 'Daylight',            color: '#87ceeb', data: [gme, ges] },
-    { label: 'Golden Hour (evening)', color: '#e8821d', data: [ges, gee] },
-    { label: 'Blue Hour (evening)', color: '#5a7db5', data: [gee, bee] },
-    { label: 'Night (end)',         color: '#1a2044', data: [bee,  24] },
-  ];
+    { label: 'Night',                         color: '#1a2044', data: [0,   ams] },
+    { label: 'Astronomical Twilight (morning)', color: '#262f63', data: [ams, nms] },
+    { label: 'Nautical Twilight (morning)',   color: '#34447f', data: [nms, bms] },
+    { label: 'Civil Twilight (morning)',      color: '#7d86c4', data: [bms, gms] },
+    { label: 'Blue Hour (morning)',           color: '#4d6fcb', data: [bms, bme] },
+    { label: 'Golden Hour (morning)',         color: '#f5a623', data: [gms, gme] },
+    { label: 'Daylight',                      color: '#87ceeb', data: [gme, ges] },
+    { label: 'Golden Hour (evening)',         color: '#e8821d', data: [ges, gee] },
+    { label: 'Civil Twilight (evening)',      color: '#7d86c4', data: [gee, bee] },
+    { label: 'Blue Hour (evening)',           color: '#5a7db5', data: [bes, bee] },
+    { label: 'Nautical Twilight (evening)',   color: '#34447f', data: [bee, nee] },
+    { label: 'Astronomical Twilight (evening)', color: '#262f63', data: [nee, aee] },
+    { label: 'Night (end)',                   color: '#1a2044', data: [aee,  24] },
+  ].filter(function(s) { return s.data[0] != null && s.data[1] != null; });
 
   var datasets = segments.map(function(s) {
     return {
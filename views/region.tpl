@@ -41,11 +41,11 @@
 <nav class="pagination" aria-label="Pagination">
   % base_href = '/country/' + region['slug_country'] + '/' + region['slug_region'] + '/'
   % if pag['has_prev']:
-  <a href="{{base_href}}?page={{pag['page'] - 1}}">&larr; Prev</a>
+  <a href="{{base_href}}{{pag['prev_qs']}}">&larr; Prev</a>
   % end
   <span>Page {{pag['page']}} of {{pag['total_pages']}}</span>
   % if pag['has_next']:
-  <a href="{{base_href}}?page={{pag['page'] + 1}}">Next &rarr;</a>
+  <a href="{{base_href}}{{pag['next_qs']}}">Next &rarr;</a>
   % end
 </nav>
 % end
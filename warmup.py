@@ -0,0 +1,141 @@
+"""
+warmup.py — Riscaldamento del processo prima delle richieste reali.
+
+Con WARMUP=true app.py chiama warmup() all'import: con gunicorn --preload
+avviene nel master prima del fork, e i worker ereditano copy-on-write template
+compilati, cache dei risultati di db.py, cache giornaliere di utils e pagine
+già rese; senza --preload avviene all'avvio di ogni worker.
+
+  WARMUP=true WARMUP_URLS_FILE=top-urls.txt gunicorn --preload app:application
+
+Passi (ognuno cronometrato):
+  1. compilazione di tutti i template in views/
+  2. apertura del DB e riempimento delle cache di continenti, paesi, conteggi
+  3. calcoli astronomici globali del giorno (fase lunare, calendario lunare)
+  4. GET delle prime WARMUP_TOP righe di WARMUP_URLS_FILE (un path per riga, in
+     ordine di popolarità, es. estratto dai log di accesso): calcoli astronomici
+     delle città più richieste e cache delle pagine
+
+Il report include la latenza della prima richiesta (il primo URL, o la
+homepage senza WARMUP_URLS_FILE) a freddo, misurata prima degli altri passi,
+e della stessa richiesta a riscaldamento finito.
+"""
+
+import io
+import os
+import sys
+import time
+
+import bottle
+
+import db
+import utils
+
+WARMUP_URLS_FILE = os.environ.get('WARMUP_URLS_FILE', '')
+WARMUP_TOP       = int(os.environ.get('WARMUP_TOP', 100))
+
+
+def _get(wsgi_app, path):
+    """GET in-process di path (con query); restituisce lo status."""
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_NAME': 'warmup', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_ACCEPT_ENCODING': 'gzip', 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+    }
+    captured = []
+    result = wsgi_app(environ, lambda status, headers, exc_info=None: captured.append(status))
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return captured[0] if captured else ''
+
+
+def compile_views():
+    """Compila ogni template nella cache usata da bottle.template(). Le istanze
+    compilate sono condivise anche per rebase/include (es. base.tpl), che
+    altrimenti ogni template ricompilerebbe alla prima esecuzione."""
+    lookup = bottle.TEMPLATE_PATH
+    names = sorted(f[:-4] for f in os.listdir('views') if f.endswith('.tpl'))
+    compiled = {}
+    for name in names:
+        tpl = bottle.TEMPLATES.get((id(lookup), name))
+        if tpl is None:
+            tpl = bottle.TEMPLATES[(id(lookup), name)] = bottle.SimpleTemplate(
+                name=name, lookup=lookup)
+        tpl.co                      # compilazione (proprietà in cache)
+        compiled[name] = tpl
+    for tpl in compiled.values():
+        for name, sub in compiled.items():
+            tpl.cache.setdefault(name, sub)
+    return len(names)
+
+
+def prime_db():
+    db.get_conn()
+    continents = db.get_continents()
+    for c in continents:
+        db.get_countries_by_continent(c['continent'])
+    db.get_all_countries()
+    db.get_sitemap_chunk_count()
+    db.get_city_count()
+    if db.NEARBY_INDEX == 'memory':
+        db.get_nearby_index()
+    return len(continents)
+
+
+def prime_astronomy():
+    utils.moon_phase()
+    utils.build_moon_calendar()
+
+
+def _top_urls(path, n):
+    if not path:
+        return []
+    with open(path, encoding='utf-8') as f:
+        urls = [line.strip() for line in f if line.strip().startswith('/')]
+    return urls[:n]
+
+
+def prime_pages(wsgi_app, urls):
+    """GET di ogni URL; restituisce quanti non hanno risposto 200."""
+    return sum(not _get(wsgi_app, url).startswith('200') for url in urls)
+
+
+def warmup(wsgi_app, urls_file=WARMUP_URLS_FILE, top=WARMUP_TOP):
+    """Esegue i passi di riscaldamento e stampa i tempi; restituisce {passo: secondi}."""
+    timings = {}
+
+    def step(label, fn, *args):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        timings[label] = time.perf_counter() - t0
+        return out
+
+    urls = _top_urls(urls_file, top)
+    probe = urls[0] if urls else '/'
+    # Quanto pagherebbe la prima richiesta di un worker senza warm-up
+    step('prima richiesta', _get, wsgi_app, probe)
+    n_views = step('template', compile_views)
+    n_cont  = step('db', prime_db)
+    step('astronomia', prime_astronomy)
+    errors  = step('pagine', prime_pages, wsgi_app, urls[1:])
+
+    t0 = time.perf_counter()
+    _get(wsgi_app, probe)
+    warm = time.perf_counter() - t0
+
+    ms = {k: v * 1000 for k, v in timings.items()}
+    print(f'Warm-up (pid {os.getpid()}) in {sum(ms.values()):.0f} ms: '
+          f'{n_views} template {ms["template"]:.0f} ms, '
+          f'DB ({n_cont} continenti) {ms["db"]:.0f} ms, '
+          f'astronomia {ms["astronomia"]:.0f} ms, '
+          f'{len(urls)} URL {ms["prima richiesta"] + ms["pagine"]:.0f} ms '
+          f'({errors} non 200)', file=sys.stderr)
+    print(f'  prima richiesta {probe}: {ms["prima richiesta"]:.1f} ms a freddo, '
+          f'{warm * 1000:.1f} ms dopo il warm-up', file=sys.stderr)
+    return timings